@@ -4,32 +4,107 @@ Python Slack Serializer class for use with the aptbot
 """
 # careful about yaml
 
+import json
+from itertools import islice
+
+SEPARATOR = '-' * 80
+SECTION_LIMIT = 3000  # characters of a Block Kit section
+BLOCK_LIMIT = 50  # blocks of a message
+
+
 class Serializer:
     """
     Instanciates a Serializer object to create message attachments.
+
+    The text of each group never changes within a snapshot, so it is
+    rendered once per gid and reused; every Snapshot has a Serializer of
+    its own, so fragments of replaced data are dropped with it.
     """
     def __init__(self):
-        pass
+        self.fragments = {}  # gid -> rendered group
+        self.headers = []  # numbered separator of each position
 
-    def groups_response(self, groups):
-        """ create attachments for all groups """
-        pre = '{} groups match your search\n'.format(len(groups))
-        result = '\n'.join(['{}\nGroup {}\n{}\n\n'.format('-' * 80, idx, '-' * 80)
-                          + self.each_group(group)
-                          for idx, (gid, group) in enumerate(groups.items(), 1)])
+    def reset(self):
+        """ forgets rendered groups, so the benchmarks can time a cold render """
+        self.fragments = {}
+
+    def groups_response(self, groups, start=0, size=None):
+        """ create attachments for the page of size groups from start, or all groups """
+        end = len(groups) if size is None else min(len(groups), start + size)
+        if start or end < len(groups):
+            pre = '{} groups match your search, showing {}-{}\n'.format(
+                len(groups), start + 1, end)
+        else:
+            pre = '{} groups match your search\n'.format(len(groups))
+        headers = self.headers  # numbered separators, extended by copy
+        if len(headers) < end:
+            headers = self.headers = headers + [
+                '{}\nGroup {}\n{}\n\n'.format(SEPARATOR, idx, SEPARATOR)
+                for idx in range(len(headers) + 1, end + 1)]
+        # only the groups of the page are rendered
+        page = islice(groups.items(), start, end)
+        result = '\n'.join([header + self.fragment(gid, group)
+                            for header, (gid, group) in zip(headers[start:end], page)])
+        if end < len(groups):
+            result += '\n\nSay "@aptbot more" for the next groups'
         return '\n'.join([pre, result])
 
+    def fragment(self, gid, group):
+        """ returns the memoized attachment of a group """
+        text = self.fragments.get(gid)
+        if text is None:
+            text = self.fragments[gid] = self.each_group(group)
+        return text
+
     def each_group(self, group):
         """ create attachments for all groups """
         return '\n\n'.join(['*{}*:\n{}'.
-                           format(k, (v if not isinstance(v, list) else ', '.join(v)))
+                           format(k, (v if not isinstance(v, (list, tuple)) else ', '.join(v)))
                            for k, v in group.items()])
 
+    def suggestions_response(self, cmmd, keys):
+        """ suggest commands for keys close to a query that matched nothing """
+        return 'Did you mean: {}?'.format(', '.join(
+            '"{} {}"'.format(cmmd, key) for key in keys))
+
+    @staticmethod
+    def sections(text):
+        """ splits text at line breaks into pieces of at most SECTION_LIMIT characters """
+        pieces, current = [], ''
+        for line in text.split('\n'):
+            while len(line) > SECTION_LIMIT:  # a single huge line is cut
+                if current:
+                    pieces.append(current)
+                    current = ''
+                pieces.append(line[:SECTION_LIMIT])
+                line = line[SECTION_LIMIT:]
+            if current and len(current) + 1 + len(line) > SECTION_LIMIT:
+                pieces.append(current)
+                current = line
+            else:
+                current = current + '\n' + line if current else line
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def chunks(self, text):
+        """
+        returns the messages to post text as: text itself if it fits one
+        section, else Block Kit messages of at most BLOCK_LIMIT sections,
+        as (fallback text, blocks json) pairs
+        """
+        if len(text) <= SECTION_LIMIT:
+            return [(text, None)]
+        blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': piece}}
+                  for piece in self.sections(text)]
+        summary = text.split('\n', 1)[0]
+        return [(summary if idx == 0 else summary + ' (continued)',
+                 json.dumps(blocks[idx:idx + BLOCK_LIMIT]))
+                for idx in range(0, len(blocks), BLOCK_LIMIT)]
+
     def default_response(self, commands):
         """ default response explaining commands"""
         pre = 'Please use one of the following commands:'
         result = ['*{}*: {}'.format(k, v) for k, v in commands.items()]
         post = 'For example, try \"@aptbot group APT 2\"'
         return '\n'.join([pre, '\n'.join(result), post])
-
-
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# per-channel and per-user admission control for Aptbot
+
+import threading
+
+CHANNEL_LIMIT = 5  # unanswered requests per channel
+USER_LIMIT = 3  # unanswered requests per user
+
+
+class Admission:
+    """
+    Instantiates a gate admitting at most `limit` unanswered requests per
+    key. A request holds its slot until release(key) is called once its
+    reply was delivered, so a flooding channel or user is shed at the door
+    instead of queueing replies Slack will only take once per second.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = {}  # key -> unanswered requests
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """ takes a slot for key, returning False if it has none left """
+        with self.lock:
+            count = self.pending.get(key, 0)
+            if count >= self.limit:
+                return False
+            self.pending[key] = count + 1
+            return True
+
+    def release(self, key):
+        """ gives back a slot of key taken by acquire """
+        with self.lock:
+            count = self.pending.get(key, 0) - 1
+            if count > 0:
+                self.pending[key] = count
+            else:
+                self.pending.pop(key, None)
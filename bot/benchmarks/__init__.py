@@ -0,0 +1,8 @@
+# benchmarks for aptbot, run from the bot directory, e.g.
+#   python -m benchmarks.bench_index
+
+import os
+import tempfile
+
+# simulated bots cache their ids by token, keep them out of the real cache
+os.environ['APTBOT_CACHE_DIR'] = os.path.join(tempfile.gettempdir(), 'aptbot-benchmarks')
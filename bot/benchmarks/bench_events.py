@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# load test of the Events API mode: posts events to a local server at
+# increasing rates, one in ten sent twice like a Slack retry, and reports
+# ack latency percentiles; answers go to a fake Slack with slow posts
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+from bot import Bot
+from events import create_app
+from outbox import Outbox
+from benchmarks.fakeslack import FakeSlackClient
+
+RATES = [50, 100, 200, 400, 800]  # events per second
+DURATION = 2  # seconds per rate
+QUERIES = ['group APT 2', 'tool backdoor', 'target japan', 'ops desert']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    client = FakeSlackClient(post_delay=0.05)
+    bot = Bot(client=client, outbox=Outbox('xoxb-fake', workers=16,
+                                           session=client.session))
+    bot.snapshot  # load before measuring
+    app = create_app(bot)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no request log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/listening'.format(server.server_port)
+    local = threading.local()
+
+    def post(body):
+        session = getattr(local, 'session', None) or requests.Session()
+        local.session = session
+        start = time.perf_counter()
+        session.post(url, data=body)
+        return time.perf_counter() - start
+
+    print('{:>6} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+        'rate/s', 'events', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)'))
+    seq = 0
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        for rate in RATES:
+            futures, start = [], time.perf_counter()
+            for i in range(rate * DURATION):
+                seq += 1
+                body = json.dumps({'event_id': 'Ev{}'.format(seq), 'event': {
+                    'type': 'app_mention', 'channel': 'C{}'.format(seq % 50),
+                    'text': '<@{}> {}'.format(client.bot_id, QUERIES[seq % 4])}})
+                time.sleep(max(0, start + i / rate - time.perf_counter()))
+                futures.append(pool.submit(post, body))
+                if seq % 10 == 0:  # a retry of the same event
+                    futures.append(pool.submit(post, body))
+            acks = [f.result() * 1000 for f in futures]
+            print('{:>6} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                rate, len(acks), percentile(acks, 50), percentile(acks, 95),
+                percentile(acks, 99), max(acks)))
+    print('queue: {}'.format(app.events.stats))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
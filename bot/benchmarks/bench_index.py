@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# compares the trigram index with the linear key scan of Bot.handle_command
+# at 1x, 10x and 100x the key count of APT.xlsx
+
+import pickle
+import timeit
+from index import TrigramIndex, COMMANDS
+
+QUERIES = [('group', 'APT 2'), ('tool', 'backdoor'),
+           ('target', 'japan'), ('ops', 'desert'), ('tool', 'x')]
+SCALES = [1, 10, 100]
+
+
+def scale(dct, factor):
+    """ returns a copy of a command map with factor times as many keys """
+    scaled = dict(dct)
+    for i in range(1, factor):
+        scaled.update(('{} #{}'.format(key, i), gid) for key, gid in dct.items())
+    return scaled
+
+
+def linear(dct, arg):
+    """ the original per-query scan """
+    return [key for key in dct if arg.lower() in key.lower()]
+
+
+def main(number=20):
+    with open('../data/command_to_gid.pkl', 'rb') as f:
+        snapshot = pickle.load(f)
+    command_to_gid = {cmmd: snapshot[cmmd] for cmmd in COMMANDS}
+
+    print('{:>5} {:>7} {:>10} {:>10} {:>8}'.format(
+        'scale', 'keys', 'scan (us)', 'index (us)', 'speedup'))
+    for factor in SCALES:
+        maps = {cmmd: scale(dct, factor) for cmmd, dct in command_to_gid.items()}
+        indexes = {cmmd: TrigramIndex(dct) for cmmd, dct in maps.items()}
+        for cmmd, arg in QUERIES:  # sanity check
+            assert indexes[cmmd].search(arg) == linear(maps[cmmd], arg)
+
+        scan = timeit.timeit(lambda: [linear(maps[c], a) for c, a in QUERIES],
+                             number=number)
+        indexed = timeit.timeit(lambda: [indexes[c].search(a) for c, a in QUERIES],
+                                number=number)
+        per_query = number * len(QUERIES) / 1e6
+        print('{:>4}x {:>7} {:>10.1f} {:>10.1f} {:>7.1f}x'.format(
+            factor, sum(map(len, maps.values())),
+            scan / per_query, indexed / per_query, scan / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# compares reading the workbook once per sheet with pd.read_excel against
+# streaming it once in read-only mode, on APT.xlsx and a synthetic
+# 50-sheet workbook; every run happens in a fresh process so peak RSS is
+# comparable
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import openpyxl as xl
+import pandas as pd
+import parser
+
+COLUMNS = ['Common Name', 'Other Name 1', 'Other Name 2', 'Toolset / Malware',
+           'Targets', 'Operation 1', 'Operation 2', 'Comment', 'Link 1']
+
+
+def per_sheet(path):
+    """ the previous build: one pd.read_excel per sheet """
+    book = xl.load_workbook(path)
+    for sheetname in book.sheetnames:
+        if sheetname != 'Home' and sheetname[0] != '_':
+            pd.read_excel(path, sheet_name=sheetname)
+
+
+def streamed(path):
+    parser.parse_apt(path)
+
+
+def synthetic_workbook(path, sheets=50, rows=400):
+    """ writes a workbook with the layout of APT.xlsx """
+    book = xl.Workbook(write_only=True)
+    book.create_sheet('Home').append(['synthetic APT groups'])
+    for s in range(sheets):
+        sheet = book.create_sheet('Country {}'.format(s))
+        sheet.append(['Country {}'.format(s)])
+        sheet.append(COLUMNS)
+        sheet.append([])
+        for r in range(rows):
+            tag = '{}-{}'.format(s, r)
+            sheet.append(['APT {}'.format(tag), 'Panda {}'.format(tag), '?unsure',
+                          'PlugX, Backdoor {0}, Tool {0}'.format(tag),
+                          'Government, Energy, Sector {}'.format(r % 17),
+                          'Operation {}'.format(tag), None,
+                          'comment ' * 20, 'http://example.com/{}'.format(tag)])
+    book.save(path)
+
+
+def run(func, path, queue):
+    start = time.perf_counter()
+    func(path)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def measure(func, path):
+    """ returns (seconds, peak RSS in MB) of func(path) in a fresh process """
+    ctx = multiprocessing.get_context('spawn')  # no memory inherited
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run, args=(func, path, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic = os.path.join(tmp, 'synthetic.xlsx')
+        synthetic_workbook(synthetic)
+        print('{:<16} {:<10} {:>8} {:>10}'.format('workbook', 'build', 'time (s)', 'RSS (MB)'))
+        for name, path in [('APT.xlsx', '../data/APT.xlsx'), ('50 sheets', synthetic)]:
+            for label, func in [('per-sheet', per_sheet), ('streamed', streamed)]:
+                elapsed, rss = measure(func, path)
+                print('{:<16} {:<10} {:>8.2f} {:>10.1f}'.format(name, label, elapsed, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# response time of the first page of a ranked result as match counts grow,
+# against resolving and rendering every match
+#
+#   python -m benchmarks.bench_ranking --scales 1 10 100 300
+
+import argparse
+import timeit
+from index import CommandIndex, build_snapshot
+from rank import Ranking
+from Serializer import Serializer
+from engine import PAGE_SIZE
+from benchmarks.corpus import generate
+
+QUERIES = [('tool', 'backdoor'), ('target', 'government'), ('group', 'panda')]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='aptbot ranking benchmark')
+    argparser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 300])
+    argparser.add_argument('--number', type=int, default=5)
+    args = argparser.parse_args()
+
+    print('{:<20} {:>6} {:>8} {:>14} {:>14}'.format(
+        'query', 'scale', 'matches', 'top page (ms)', 'render all (ms)'))
+    for scale in args.scales:
+        groups = generate(scale)
+        index = CommandIndex(build_snapshot(groups), groups)
+        serializer = Serializer()
+        for cmmd, arg in QUERIES:
+            def top_page():
+                ranking = Ranking(index.scores(cmmd, arg), index)
+                return serializer.groups_response(ranking, 0, PAGE_SIZE)
+
+            def render_all():
+                return serializer.groups_response(index.find(cmmd, arg))
+
+            top_page(), render_all()  # memoize fragments for both
+            print('{:<20} {:>6} {:>8} {:>14.2f} {:>14.2f}'.format(
+                '{} {}'.format(cmmd, arg), scale, len(index.scores(cmmd, arg)),
+                timeit.timeit(top_page, number=args.number) / args.number * 1e3,
+                timeit.timeit(render_all, number=args.number) / args.number * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# compares the memory of groups.pkl held as plain dicts with compact
+# GroupRecords at 1x and 100x the dataset size
+
+import gc
+import multiprocessing
+import pickle
+import os
+import tracemalloc
+from records import compact
+
+SCALES = [1, 100]
+
+
+def build(factor, records):
+    """ returns factor copies of groups.pkl, unpickled separately like
+    independent feeds so equal strings are distinct objects, and
+    compacted copy by copy when records is set """
+    with open('../data/groups.pkl', 'rb') as f:
+        data = f.read()
+    groups = {}
+    for i in range(factor):
+        copy = {'{}#{}'.format(gid, i): group
+                for gid, group in pickle.loads(data).items()}
+        groups.update(compact(copy) if records else copy)
+    return groups
+
+
+def traced(factor, records):
+    """ returns MB allocated by the live result of build """
+    gc.collect()
+    tracemalloc.start()
+    result = build(factor, records)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / 2 ** 20
+
+
+def resident():
+    """ returns the current RSS in MB (Linux) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def resident_growth(factor, records, queue):
+    before = resident()
+    result = build(factor, records)
+    gc.collect()
+    queue.put(resident() - before)
+    del result
+
+
+def rss(factor, records):
+    """ returns RSS growth in MB of a fresh process holding the groups """
+    ctx = multiprocessing.get_context('spawn')  # no memory inherited
+    queue = ctx.Queue()
+    proc = ctx.Process(target=resident_growth, args=(factor, records, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    print('{:>5} {:<8} {:>16} {:>14}'.format('scale', 'groups', 'tracemalloc (MB)', 'RSS (MB)'))
+    for factor in SCALES:
+        for label, records in [('dicts', False), ('records', True)]:
+            print('{:>4}x {:<8} {:>16.2f} {:>14.1f}'.format(
+                factor, label, traced(factor, records), rss(factor, records)))
+
+
+if __name__ == '__main__':
+    main()
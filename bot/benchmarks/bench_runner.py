@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# compares answer latency of the asyncio runner with the 1-second polling
+# loop, driving both through a fake RTM socket
+
+import random
+import statistics
+import threading
+import time
+from bot import Bot
+from runner import AsyncRunner
+from outbox import Outbox
+from benchmarks.fakeslack import FakeSlackClient
+
+QUERIES = ['group APT 2', 'tool backdoor', 'target japan', 'ops desert']
+
+
+def drive(client, messages, interval):
+    """ injects messages on distinct channels with random spacing """
+    rng = random.Random(0)
+    for i in range(messages):
+        client.inject(rng.choice(QUERIES), 'C{}'.format(i))
+        time.sleep(rng.uniform(0, 2 * interval))
+
+
+def latencies(client, messages, timeout=60):
+    """ waits for every answer and returns per-message latencies in ms """
+    deadline = time.time() + timeout
+    while len(client.posts) < messages and time.time() < deadline:
+        time.sleep(0.01)
+    return [(posted - client.sent[kwargs['channel']]) * 1000
+            for posted, kwargs in client.posts]
+
+
+def measure(loop, messages, interval, post_delay):
+    client = FakeSlackClient(post_delay=post_delay)
+    bot = Bot(client=client, outbox=Outbox('xoxb-fake', session=client.session))
+    threading.Thread(target=loop, args=(bot,), daemon=True).start()
+    drive(client, messages, interval)
+    return latencies(client, messages)
+
+
+def report(name, result):
+    result = sorted(result)
+    print('{:<8} n={:<4} mean={:8.1f}ms p50={:8.1f}ms max={:8.1f}ms'.format(
+        name, len(result), statistics.mean(result),
+        result[len(result) // 2], result[-1]))
+
+
+def main(messages=10, interval=0.05, post_delay=0.2):
+    report('polling', measure(Bot.run_polling, messages, interval, post_delay))
+    report('asyncio', measure(lambda bot: AsyncRunner(bot).run(),
+                              messages, interval, post_delay))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# compares rendering every group per query with joining memoized fragments
+
+import pickle
+import timeit
+from Serializer import Serializer
+from index import CommandIndex
+
+QUERIES = [('tool', 'backdoor'), ('group', 'a'), ('group', '')]
+
+
+def main(number=200):
+    with open('../data/groups.pkl', 'rb') as f:
+        gid_to_group = pickle.load(f)
+    with open('../data/command_to_gid.pkl', 'rb') as f:
+        index = CommandIndex(pickle.load(f), gid_to_group)
+
+    print('{:<16} {:>6} {:>12} {:>12} {:>8}'.format(
+        'query', 'groups', 'render (us)', 'memo (us)', 'speedup'))
+    for cmmd, arg in QUERIES:
+        groups = index.find(cmmd, arg)
+        cold, warm = Serializer(), Serializer()
+        assert cold.groups_response(groups) == warm.groups_response(groups)
+
+        def render():
+            cold.reset()
+            cold.groups_response(groups)
+
+        rendered = timeit.timeit(render, number=number) / number * 1e6
+        memo = timeit.timeit(lambda: warm.groups_response(groups),
+                             number=number) / number * 1e6
+        print('{:<16} {:>6} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+            '{} {}'.format(cmmd, arg), len(groups), rendered, memo, rendered / memo))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# breaks bot startup down into import, identity, connect and data-load
+# phases, each run in a fresh process against a fake Slack team
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+MEMBERS = 20000  # users in the simulated workspace
+API_DELAY = 0.05  # simulated round trip of each Slack API call
+
+
+def startup(mode, cache_dir, queue):
+    """ times the phases of one startup; mode is eager, cold or warm """
+    os.environ['BOT_TOKEN'] = 'xoxb-bench'
+    os.environ['APTBOT_CACHE_DIR'] = cache_dir
+    phases = {}
+
+    start = time.perf_counter()
+    from bot import Bot
+    from outbox import Outbox
+    from benchmarks.fakeslack import FakeSlackClient
+    phases['import'] = time.perf_counter() - start
+
+    client = FakeSlackClient(members=MEMBERS, api_delay=API_DELAY)
+    start = time.perf_counter()
+    bot = Bot(client=client, outbox=Outbox('xoxb-bench', session=client.session))
+    if mode == 'eager':  # the previous startup: scan users.list
+        bot.bot_id = bot.find_bot_id()
+    bot.at_bot
+    phases['identity'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == 'eager':  # the previous startup: load data before connecting
+        bot.snapshot
+    phases['data'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.rtm_connect()
+    phases['connect'] = time.perf_counter() - start
+    phases['ready'] = sum(phases.values())
+
+    start = time.perf_counter()
+    bot.handle_command('tool backdoor')  # lazy modes load data here
+    phases['first query'] = time.perf_counter() - start
+    queue.put(phases)
+
+
+def measure(mode, cache_dir):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=startup, args=(mode, cache_dir, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    columns = ['import', 'identity', 'data', 'connect', 'ready', 'first query']
+    print('{:<12}'.format('startup (ms)') + ''.join('{:>13}'.format(c) for c in columns))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # cold resolves the id with auth.test and caches it for warm
+        for mode in ['eager', 'cold', 'warm']:
+            phases = measure(mode, cache_dir)
+            print('{:<12}'.format(mode) +
+                  ''.join('{:>13.1f}'.format(phases[c] * 1000) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
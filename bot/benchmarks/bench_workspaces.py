@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# scales one process from 1 to 100 simulated workspaces on a fake Slack,
+# comparing a Hub sharing one engine, outbox and thread pool with one
+# independent Bot per workspace; each run happens in a fresh process
+
+import asyncio
+import gc
+import multiprocessing
+import os
+import time
+
+COUNTS = [1, 10, 50, 100]
+QUERIES = ['group APT 2', 'tool backdoor', 'target japan', 'ops desert']
+
+
+def resident():
+    """ returns the current RSS in MB (Linux) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def workspaces(count, shared, queue):
+    from bot import Bot
+    from engine import Engine
+    from outbox import Outbox
+    from runner import AsyncRunner
+    from workspaces import Hub
+    from benchmarks.fakeslack import FakeSlackClient
+
+    sink = FakeSlackClient()  # records every chat.postMessage
+    gc.collect()
+    before = resident()
+    clients = [FakeSlackClient(bot_id='UBOT{}'.format(i)) for i in range(count)]
+    if shared:
+        hub = Hub(outbox=Outbox(None, session=sink.session))
+        bots = [hub.add('xoxb-{}'.format(i), client) for i, client in enumerate(clients)]
+        runners = [AsyncRunner(bot, hub.concurrency, hub.executor) for bot in bots]
+    else:
+        bots = [Bot(client=client, token='xoxb-{}'.format(i), engine=Engine(),
+                    outbox=Outbox('xoxb-{}'.format(i), session=sink.session))
+                for i, client in enumerate(clients)]
+        runners = [AsyncRunner(bot) for bot in bots]
+    for bot in bots:
+        bot.snapshot  # every engine loads its data
+        bot.at_bot
+
+    async def serve():
+        tasks = [asyncio.ensure_future(runner.serve()) for runner in runners]
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        for i, client in enumerate(clients):
+            client.inject(QUERIES[i % 4], 'C{}'.format(i))
+        while len(sink.posts) < count:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        for task in tasks:
+            task.cancel()
+        return elapsed
+
+    elapsed = asyncio.run(serve())
+    sent = {}
+    for client in clients:
+        sent.update(client.sent)
+    latencies = sorted(posted - sent[kwargs['channel']] for posted, kwargs in sink.posts)
+    gc.collect()
+    queue.put((resident() - before, latencies[len(latencies) // 2] * 1000, elapsed * 1000))
+
+
+def measure(count, shared):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=workspaces, args=(count, shared, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    print('{:>10} {:<12} {:>9} {:>13} {:>13}'.format(
+        'workspaces', 'mode', 'RSS (MB)', 'p50 (ms)', 'all (ms)'))
+    for count in COUNTS:
+        for label, shared in [('hub', True), ('independent', False)]:
+            rss, p50, total = measure(count, shared)
+            print('{:>10} {:<12} {:>9.1f} {:>13.1f} {:>13.1f}'.format(
+                count, label, rss, p50, total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# synthetic APT corpora in the shape parser.parse_apt produces, for
+# benchmarking at scales the sample workbook cannot reach
+
+import os
+import pickle
+import random
+from index import build_snapshot
+
+BASE_GROUPS = 158  # groups in APT.xlsx, the 1x scale
+
+COUNTRIES = ['China', 'Russia', 'North Korea', 'Iran', 'Israel', 'NATO',
+             'Middle East', 'Others', 'Unknown']
+ANIMALS = ['Panda', 'Bear', 'Chollima', 'Kitten', 'Spider', 'Tiger', 'Jackal']
+ADJECTIVES = ['Putter', 'Gothic', 'Fancy', 'Cozy', 'Charming', 'Silent', 'Ricochet',
+              'Venomous', 'Stone', 'Wicked', 'Nomad', 'Hidden', 'Dark', 'Lucky']
+TOOLS = ['PlugX', 'Mimikatz', 'Poison Ivy', 'Gh0st RAT', 'X-Agent', 'Sofacy',
+         'Cobalt Strike', 'BlackEnergy', 'Shamoon', 'Derusbi', 'Winnti', 'HttpBrowser',
+         'Sakula', 'Backdoor.Apt.Fexel', 'Backdoor.Wiper', 'China Chopper', 'NetTraveler']
+SECTORS = ['Government', 'Defense', 'Energy', 'Financial Institutions', 'Telecommunications',
+           'Aerospace', 'Healthcare', 'Media', 'Japan', 'South Korea', 'USA', 'Europe',
+           'Think Tanks', 'Manufacturing', 'Transportation', 'High Tech']
+WORDS = ['Aurora', 'Desert', 'Falcon', 'Ghost', 'Shady', 'Wolf', 'Fox', 'Red',
+         'Night', 'Dragon', 'Storm', 'Clandestine', 'Double', 'Tap', 'Iron', 'Tiger']
+VENDORS = ['CrowdStrike', 'Mandiant', 'Symantec', 'Kaspersky', 'iSight', 'FireEye',
+           'Dell Secure Works', 'Palo Alto Unit 42', 'Cisco (VRT/Sourcefire)']
+
+
+def make_group(rng, serial, country):
+    """ returns one synthetic group dict with the attrs parse_sheet fills """
+    group = {'country': country,
+             'names': ['APT {}'.format(serial),
+                       '{} {}'.format(rng.choice(ADJECTIVES), rng.choice(ANIMALS))]}
+    if rng.random() < 0.3:
+        group['operations'] = ['Operation {} {}'.format(rng.choice(WORDS), rng.choice(WORDS))
+                               for _ in range(rng.randint(1, 3))]
+    for vendor in rng.sample(VENDORS, rng.randint(0, 4)):
+        group[vendor] = '{} {}'.format(rng.choice(ADJECTIVES), rng.choice(ANIMALS))
+    if rng.random() < 0.5:  # shared tools plus a few unique to the group
+        group['tools'] = rng.sample(TOOLS, rng.randint(1, 4)) + \
+            [' Tool{}-{}'.format(serial, i) for i in range(rng.randint(0, 3))]
+    if rng.random() < 0.6:
+        group['targets'] = rng.sample(SECTORS, rng.randint(1, 5))
+    if rng.random() < 0.3:
+        group['Comment'] = ' '.join(rng.choice(WORDS).lower() for _ in range(30))
+    for link in range(1, rng.randint(1, 6)):
+        group['Link {}'.format(link)] = 'http://example.com/apt{}/{}'.format(serial, link)
+    return group
+
+
+def generate(scale, seed=0):
+    """ returns a gid -> group map with scale times the groups of APT.xlsx """
+    rng = random.Random(seed)
+    groups = {}
+    for serial in range(BASE_GROUPS * scale):
+        sheet_idx = rng.randrange(len(COUNTRIES))
+        gid = '{}_{}'.format(sheet_idx + 1, serial + 2)
+        groups[gid] = make_group(rng, serial, COUNTRIES[sheet_idx])
+    return groups
+
+
+def write_snapshot(groups, path):
+    """ writes groups.pkl and command_to_gid.pkl for groups to path """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'groups.pkl'), 'wb') as f:
+        pickle.dump(groups, f)
+    with open(os.path.join(path, 'command_to_gid.pkl'), 'wb') as f:
+        pickle.dump(build_snapshot(groups), f)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# local stand-in for the parts of SlackClient used by Bot
+
+import json
+import socket
+import threading
+import time
+
+
+class FakeWebSocket:
+    """ holds the socket the runner waits on, like websocket-client does """
+    def __init__(self, sock):
+        self.sock = sock
+
+
+class FakeServer:
+    def __init__(self, sock):
+        self.websocket = FakeWebSocket(sock)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """
+    stands in for the requests session of an Outbox, recording posts on
+    its client; with rate_limit set it answers 429 like Slack does when a
+    channel gets more than rate_limit messages per second
+    """
+    def __init__(self, client, rate_limit=None):
+        self.client = client
+        self.rate_limit = rate_limit
+        self.last = {}  # channel -> time of last accepted post
+
+    def post(self, url, data=None, timeout=None):
+        channel, now = data['channel'], time.perf_counter()
+        if self.rate_limit:
+            with self.client.lock:
+                if now - self.last.get(channel, -1e9) < 1 / self.rate_limit:
+                    return FakeResponse(429, {'ok': False, 'error': 'ratelimited'},
+                                        {'Retry-After': str(1 / self.rate_limit)})
+                self.last[channel] = now
+        return FakeResponse(200, self.client.api_call('chat.postMessage', **data))
+
+
+class FakeSlackClient:
+    """
+    Instantiates a fake SlackClient whose RTM stream is one end of a local
+    socket pair. inject() writes events to the other end; chat.postMessage
+    calls are recorded with the time they were made.
+    """
+    def __init__(self, bot_name='aptbot', bot_id='UAPTBOT', post_delay=0.0,
+                 members=1, api_delay=0.0):
+        self.bot_name, self.bot_id = bot_name, bot_id
+        self.post_delay = post_delay  # simulated chat.postMessage latency
+        self.api_delay = api_delay  # simulated latency of other API calls
+        self.members = members  # users in the team, the bot listed last
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.server = FakeServer(self.sock)
+        self.buffer = b''
+        self.posts = []  # (time posted, kwargs)
+        self.sent = {}  # channel -> time the mention was injected
+        self.lock = threading.Lock()
+        self.session = FakeSession(self)
+
+    def rtm_connect(self):
+        time.sleep(self.api_delay)
+        # like SlackClient, keep the rtm.start reply naming the bot
+        self.server.login_data = {'self': {'id': self.bot_id, 'name': self.bot_name}}
+        return True
+
+    def rtm_read(self):
+        """ returns the next event if one is readable; like websocket_safe_read
+        this yields at most one websocket frame per call """
+        try:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('fake RTM socket closed')
+            self.buffer += chunk
+        except BlockingIOError:
+            pass
+        line, sep, rest = self.buffer.partition(b'\n')
+        if not sep:
+            return []
+        self.buffer = rest
+        return [json.loads(line.decode('utf-8'))]
+
+    def api_call(self, method, **kwargs):
+        if method == 'auth.test':
+            time.sleep(self.api_delay)
+            return {'ok': True, 'user': self.bot_name, 'user_id': self.bot_id}
+        if method == 'users.list':
+            # the reply is built and parsed in full like a real one
+            members = [{'name': 'user{}'.format(i), 'id': 'U{:08d}'.format(i),
+                        'profile': {'real_name': 'User {}'.format(i)}}
+                       for i in range(self.members - 1)]
+            members.append({'name': self.bot_name, 'id': self.bot_id})
+            time.sleep(self.api_delay)
+            return json.loads(json.dumps({'ok': True, 'members': members}))
+        if method == 'chat.postMessage':
+            time.sleep(self.post_delay)
+            with self.lock:
+                self.posts.append((time.perf_counter(), kwargs))
+            return {'ok': True}
+        return {'ok': False, 'error': 'unknown_method'}
+
+    def inject(self, text, channel):
+        """ sends a message mentioning the bot on the RTM stream """
+        event = {'type': 'message', 'channel': channel,
+                 'text': '<@{}> {}'.format(self.bot_id, text)}
+        self.sent[channel] = time.perf_counter()
+        self.peer.sendall(json.dumps(event).encode('utf-8') + b'\n')
+
+    def close(self):
+        self.peer.close()
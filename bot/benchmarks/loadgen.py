@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# end-to-end load generator: runs Bot.run against a local Slack stand-in
+# and replays a query mix at increasing message rates, reporting
+# end-to-end latency percentiles (mention sent on the RTM socket to
+# chat.postMessage received) and the rate at which the bot falls behind
+#
+#   python -m benchmarks.loadgen --rates 10 50 100 200 400 --duration 5
+
+import argparse
+import pickle
+import random
+import threading
+import time
+from bot import Bot
+from outbox import Outbox
+from index import COMMANDS
+from benchmarks.localslack import LocalSlack, LocalSlackClient
+
+
+def query_mix(seed=0, misses=0.1):
+    """ yields queries over real keys of the snapshot, some of them misses """
+    with open('../data/command_to_gid.pkl', 'rb') as f:
+        snapshot = pickle.load(f)
+    keys = [(cmmd, key.strip()) for cmmd in COMMANDS for key in snapshot[cmmd] if key.strip()]
+    rng = random.Random(seed)
+    while True:
+        if rng.random() < misses:
+            yield 'tool nosuchtool{}'.format(rng.randrange(1000))
+        elif rng.random() < 0.1:
+            yield 'help'
+        else:
+            cmmd, key = rng.choice(keys)
+            start = rng.randrange(max(1, len(key) - 3))  # a substring of a key
+            yield '{} {}'.format(cmmd, key[start:start + rng.randint(3, 12)])
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def step(slack, queries, rate, duration, offset, drain):
+    """ sends rate messages per second for duration seconds, each on its own
+    channel, and returns the sorted latencies in ms and the count sent """
+    count = int(rate * duration)
+    channels = ['C{}'.format(offset + i) for i in range(count)]
+    start = time.perf_counter()
+    for i, channel in enumerate(channels):
+        time.sleep(max(0, start + i / rate - time.perf_counter()))
+        slack.inject(next(queries), channel)
+    deadline = time.perf_counter() + drain
+    wanted = set(channels)
+    while time.perf_counter() < deadline:
+        with slack.lock:
+            done = sum(1 for _, form in slack.posts if form['channel'] in wanted)
+        if done >= count:
+            break
+        time.sleep(0.01)
+    with slack.lock:
+        latencies = sorted((posted - slack.sent[form['channel']]) * 1000
+                           for posted, form in slack.posts if form['channel'] in wanted)
+    return latencies, count
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='aptbot end-to-end load generator')
+    argparser.add_argument('--rates', type=float, nargs='+',
+                           default=[10, 50, 100, 200, 400, 800])
+    argparser.add_argument('--duration', type=float, default=5, help='seconds per rate')
+    argparser.add_argument('--drain', type=float, default=5,
+                           help='seconds to wait for answers after each rate')
+    argparser.add_argument('--slo', type=float, default=1000,
+                           help='p99 latency in ms above which the bot is behind')
+    argparser.add_argument('--post-delay', type=float, default=0.02,
+                           help='simulated chat.postMessage latency in seconds')
+    argparser.add_argument('--workers', type=int, default=8, help='outbox workers')
+    args = argparser.parse_args()
+
+    slack = LocalSlack(post_delay=args.post_delay)
+    client = LocalSlackClient(slack)
+    bot = Bot(client=client, outbox=Outbox(client.token, workers=args.workers, url=slack.url))
+    threading.Thread(target=bot.run, daemon=True).start()
+    slack.connected.wait(10)
+    bot.snapshot  # load data before measuring
+
+    queries = query_mix()
+    print('{:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+        'rate/s', 'sent', 'answered', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'achieved/s'))
+    offset, behind = 0, None
+    for rate in args.rates:
+        latencies, count = step(slack, queries, rate, args.duration, offset, args.drain)
+        offset += count
+        p99 = percentile(latencies, 99)
+        print('{:>8.0f} {:>6} {:>9} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f}'.format(
+            rate, count, len(latencies), percentile(latencies, 50),
+            percentile(latencies, 95), p99,
+            len(latencies) / (args.duration + (latencies[-1] / 1000 if latencies else 0))))
+        if len(latencies) < count or p99 > args.slo:
+            behind = rate
+            break
+    if behind:
+        print('bot falls behind at {:.0f} messages/s'.format(behind))
+    else:
+        print('bot kept up with every rate')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# local stand-in Slack server speaking HTTP for the Web API methods Bot
+# uses (rtm.start, rtm.connect, auth.test, users.list, chat.postMessage)
+# and a plain websocket for RTM events, plus a SlackClient pointed at it
+
+import base64
+import hashlib
+import json
+import queue
+import select
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import requests
+from slackclient import SlackClient
+from slackclient._server import Server
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def text_frame(text):
+    """ returns an unmasked websocket text frame, as servers send them """
+    payload = text.encode('utf-8')
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x81, len(payload))
+    elif len(payload) < 2 ** 16:
+        header = struct.pack('!BBH', 0x81, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, len(payload))
+    return header + payload
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive for the pooled sessions
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, status=200, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        method = self.path.rsplit('/', 1)[-1]
+        status, body, headers = self.server.slack.api(method, form)
+        self.reply(body, status, headers)
+
+    def do_GET(self):
+        if self.path != '/rtm' or 'Sec-WebSocket-Key' not in self.headers:
+            return self.reply({'ok': False}, 404)
+        accept = base64.b64encode(hashlib.sha1(
+            (self.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        events = self.server.slack.subscribe()
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            self.wfile.write(text_frame(json.dumps(event)))
+            self.wfile.flush()
+        self.close_connection = True
+
+
+class LocalSlack:
+    """
+    Instantiates and starts a local Slack stand-in on a free port.
+
+    inject() sends a message mentioning the bot to every RTM connection;
+    every chat.postMessage is recorded with the time it arrived. With
+    rate_limit set, a channel posted to more often gets a 429.
+    """
+    def __init__(self, bot_name='aptbot', bot_id='UAPTBOT', members=100,
+                 post_delay=0.0, rate_limit=None):
+        self.bot_name, self.bot_id = bot_name, bot_id
+        self.members = members
+        self.post_delay = post_delay
+        self.rate_limit = rate_limit
+        self.subscribers = []
+        self.posts = []  # (time posted, form)
+        self.sent = {}  # channel -> time the mention was injected
+        self.last = {}  # channel -> time of last accepted post
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.slack = self
+        self.url = 'http://127.0.0.1:{}/api/'.format(self.httpd.server_port)
+        self.ws_url = 'ws://127.0.0.1:{}/rtm'.format(self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def api(self, method, form):
+        """ returns (status, body, headers) of a Web API call """
+        me = {'id': self.bot_id, 'name': self.bot_name}
+        if method in ('rtm.start', 'rtm.connect'):
+            return 200, {'ok': True, 'url': self.ws_url, 'self': me,
+                         'team': {'domain': 'local'}, 'channels': [],
+                         'groups': [], 'ims': [], 'users': []}, None
+        if method == 'auth.test':
+            return 200, {'ok': True, 'user': self.bot_name, 'user_id': self.bot_id}, None
+        if method == 'users.list':
+            members = [{'name': 'user{}'.format(i), 'id': 'U{:08d}'.format(i)}
+                       for i in range(self.members - 1)] + [me]
+            return 200, {'ok': True, 'members': members}, None
+        if method == 'chat.postMessage':
+            time.sleep(self.post_delay)
+            now, channel = time.perf_counter(), form.get('channel')
+            with self.lock:
+                if self.rate_limit and now - self.last.get(channel, -1e9) < 1 / self.rate_limit:
+                    return 429, {'ok': False, 'error': 'ratelimited'}, \
+                        {'Retry-After': str(1 / self.rate_limit)}
+                self.last[channel] = now
+                self.posts.append((now, form))
+            return 200, {'ok': True, 'channel': channel}, None
+        return 200, {'ok': False, 'error': 'unknown_method'}, None
+
+    def subscribe(self):
+        events = queue.Queue()
+        with self.lock:
+            self.subscribers.append(events)
+        self.connected.set()
+        return events
+
+    def inject(self, text, channel, user=None):
+        """ sends a message mentioning the bot on every RTM connection, by
+        default from a user of its own per channel """
+        event = {'type': 'message', 'channel': channel, 'user': user or 'U' + channel,
+                 'text': '<@{}> {}'.format(self.bot_id, text)}
+        with self.lock:
+            self.sent[channel] = time.perf_counter()
+            for events in self.subscribers:
+                events.put(event)
+
+    def close(self):
+        with self.lock:
+            for events in self.subscribers:
+                events.put(None)
+        self.httpd.shutdown()
+
+
+class LocalRequest:
+    """ sends slackclient's Web API calls to a LocalSlack instead of slack.com """
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+
+    def do(self, token, request='?', post_data=None, domain=None):
+        post_data = dict(post_data or {}, token=token)
+        return self.session.post(self.url + request, data=post_data)
+
+
+class LocalServer(Server):
+    """ a slackclient Server for a plain ws:// socket, which unlike TLS
+    raises on a read with no data instead of reporting SSLWantRead """
+    def websocket_safe_read(self):
+        if not select.select([self.websocket.sock], [], [], 0)[0]:
+            return ''
+        return self.websocket.recv()
+
+
+class LocalSlackClient(SlackClient):
+    """ instantiates a real SlackClient talking to a LocalSlack """
+    def __init__(self, slack, token='xoxb-local'):
+        super().__init__(token)
+        self.server = LocalServer(token, False)
+        self.server.api_requester = LocalRequest(slack.url)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# query-engine micro-benchmarks on synthetic corpora from 1x to 1000x the
+# size of APT.xlsx, emitting one JSON record per measurement so results
+# of two commits can be compared:
+#
+#   python -m benchmarks.suite --output before.json
+#   python -m benchmarks.suite --compare before.json
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from snapshot import Snapshot
+from Serializer import Serializer
+from engine import PAGE_SIZE
+from rank import Ranking
+from query import parse, evaluate, score
+from benchmarks.corpus import generate, write_snapshot
+
+QUERIES = {'group': ['APT 2', 'panda', 'Cozy Bear', 'zz'],
+           'tool': ['plugx', 'backdoor', 'Tool1-', 'x'],
+           'target': ['japan', 'government', 'finan', 'e'],
+           'ops': ['desert', 'operation', 'Wolf Fox', 'q']}
+COMPOUND = ['country China AND tool plugx AND target japan',
+            'tool backdoor AND NOT country china',
+            '(tool plugx OR tool mimikatz) AND country russia',
+            'target government AND tool nosuchtool']
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(func, repeat):
+    """ returns the best of repeat runs of func, in microseconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+
+def bench_scale(scale, repeat):
+    """ yields the measurements of one corpus scale """
+    groups = generate(scale)
+    with tempfile.TemporaryDirectory() as tmp:
+        write_snapshot(groups, tmp)
+        start = time.perf_counter()
+        snapshot = Snapshot(tmp + '/')
+        load = time.perf_counter() - start
+    yield {'bench': 'snapshot_load', 'scale': scale, 'groups': len(groups),
+           'us': load * 1e6}
+
+    index, serializer = snapshot.index, snapshot.serializer
+
+    def answer(scores):
+        """ ranks scored ids and renders the first page, as the engine does """
+        return serializer.groups_response(Ranking(scores, index), 0, PAGE_SIZE)
+
+    for cmmd, args in QUERIES.items():
+        matches = sum(len(index.scores(cmmd, arg)) for arg in args)
+        yield {'bench': 'lookup', 'command': cmmd, 'scale': scale, 'matches': matches,
+               'us': timed(lambda: [answer(index.scores(cmmd, arg)) for arg in args],
+                           repeat) / len(args)}
+
+    def scored(plan):
+        term_scores = []  # id -> score map of each term
+        return score(evaluate(plan, index, term_scores), term_scores)
+
+    plans = [parse(text) for text in COMPOUND]
+    yield {'bench': 'lookup', 'command': 'query', 'scale': scale,
+           'matches': sum(len(scored(plan)) for plan in plans),
+           'us': timed(lambda: [answer(scored(plan)) for plan in plans],
+                       repeat) / len(plans)}
+
+    results = index.find('tool', 'backdoor')
+    for mode in ['cold', 'memo']:
+        serializer = Serializer()
+        serializer.groups_response(results)
+
+        def render():
+            if mode == 'cold':
+                serializer.reset()
+            serializer.groups_response(results)
+
+        yield {'bench': 'serialize', 'mode': mode, 'scale': scale,
+               'groups': len(results), 'us': timed(render, repeat)}
+
+
+def key(record):
+    return tuple(sorted((k, v) for k, v in record.items()
+                        if k not in ('us', 'commit', 'matches', 'groups')))
+
+
+def compare(records, baseline_path, threshold):
+    """ prints records that got slower than baseline by more than threshold """
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in map(json.loads, f)}
+    regressions = 0
+    for record in records:
+        old = baseline.get(key(record))
+        if old:
+            ratio = record['us'] / old['us']
+            flag = 'REGRESSION' if ratio > 1 + threshold else ''
+            regressions += bool(flag)
+            print('{:<48} {:>12.1f} {:>12.1f} {:>7.2f}x {}'.format(
+                ' '.join('{}={}'.format(k, v) for k, v in key(record)),
+                old['us'], record['us'], ratio, flag))
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='aptbot query-engine benchmarks')
+    argparser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000])
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--output', help='file to write JSON lines to')
+    argparser.add_argument('--compare', help='JSON lines of a previous run')
+    argparser.add_argument('--threshold', type=float, default=0.2,
+                           help='slowdown reported as a regression')
+    args = argparser.parse_args()
+
+    os.environ.pop('APTBOT_DB', None)  # measure the in-memory index
+    records, revision = [], commit()
+    for scale in args.scales:
+        for record in bench_scale(scale, args.repeat):
+            record['commit'] = revision
+            records.append(record)
+            if not args.compare:
+                print(json.dumps(record))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.writelines(json.dumps(r) + '\n' for r in records)
+    if args.compare:
+        raise SystemExit(1 if compare(records, args.compare, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
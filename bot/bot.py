@@ -4,35 +4,94 @@
 
 import os
 import time
-import pickle
-from Serializer import Serializer
+import threading
+from collections import OrderedDict
+from engine import Engine
+from cache import ResponseCache
+from runner import AsyncRunner
+from outbox import Outbox
+from snapshot import SnapshotWatcher
+from identity import IdentityCache
+from metrics import METRICS, serve_from_env
+from admission import Admission, CHANNEL_LIMIT, USER_LIMIT
 from slackclient import SlackClient
 
 
 class Bot:
-    """ Instantiates a Bot object to handle Slack onboarding interactions."""
-    def __init__(self):
+    """
+    Instantiates a Bot object to handle Slack onboarding interactions.
+
+    A Bot is one workspace connection with its own token, client and
+    outbox; lookups are answered by its Engine, which may be shared.
+    """
+    def __init__(self, client=None, outbox=None, token=None, engine=None):
         self.name = "aptbot"
         self.emoji = ':robot_face:'
-        self.token = os.environ.get('BOT_TOKEN')
-        self.client = SlackClient(self.token)
-        self.bot_id = self.get_bot_id()
-        self.at_bot = '<@' + self.bot_id + '>'
-        self.serializer = Serializer()
-        self.commands = {
-            'group': 'information about the APT group(s) containing given name',
-            'tool': 'list of APT groups that use given tool',
-            'target': 'list of APT groups that target given asset or organization',
-            'ops': 'list of APT group that executed given operation'
-        }
-        path = '../data/'
-        with open(path + 'groups.pkl', 'rb') as f:
-            self.gid_to_group = pickle.load(f)  # dict of groups
-        with open(path + 'command_to_gid.pkl', 'rb') as f:
-            self.command_to_gid = pickle.load(f)
+        self.token = token or os.environ.get('BOT_TOKEN')
+        self.client = client or SlackClient(self.token)
+        self.outbox = outbox or Outbox(self.token)
+        self.engine = engine or Engine()
+        self.identities = IdentityCache()
+        self.bot_id = self.identities.get(self.token)  # else resolved when needed
+        # channel -> (groups, start of next page) of its last long result
+        self.cursors = ResponseCache(maxsize=1000, ttl=900)
+        # requests of a channel or user wait for their replies in bounded numbers
+        self.channel_admission = Admission(CHANNEL_LIMIT)
+        self.user_admission = Admission(USER_LIMIT)
+        self.admitted = {}  # (text, channel) -> users of admitted requests
+        self.admitted_lock = threading.Lock()
+        self.stats = {'shed_channel': 0, 'shed_user': 0}
+        # channels allowed to run the reload command
+        self.admin_channels = set(filter(None, os.environ.get(
+            'APTBOT_ADMIN_CHANNELS', '').split(',')))
+
+    @property
+    def at_bot(self):
+        """ returns the mention of the bot, resolving its id on first use """
+        if self.bot_id is None:
+            self.bot_id = self.get_bot_id()
+            self.identities.put(self.token, self.bot_id)
+        return '<@' + self.bot_id + '>'
+
+    def connect(self):
+        """ opens the rtm connection, returning whether it succeeded; the
+        bot id it reports replaces a cached one that differs """
+        if not self.client.rtm_connect():
+            return False
+        login_data = getattr(self.client.server, 'login_data', None)
+        bot_id = login_data and login_data.get('self', {}).get('id')
+        if bot_id and bot_id != self.bot_id:
+            self.bot_id = bot_id
+            self.identities.put(self.token, bot_id)
+        return True
+
+    @property
+    def snapshot(self):
+        """ returns the current data snapshot of the engine """
+        return self.engine.snapshot
+
+    def reload(self, channel=''):
+        """ reloads the engine's data, reporting to channel if given """
+        report = self.engine.reload()
+        if channel:
+            self.post(channel, report)
 
     def get_bot_id(self):
         """ gets bot id using token """
+        # the rtm.start reply of a connected client names the bot
+        login_data = getattr(self.client.server, 'login_data', None)
+        if login_data:
+            return login_data['self']['id']
+
+        # otherwise ask who the token belongs to
+        api_call = self.client.api_call('auth.test')
+        if api_call.get('ok'):
+            return api_call.get('user_id')
+
+        return self.find_bot_id()
+
+    def find_bot_id(self):
+        """ gets bot id by scanning every user of the team """
         # retrieve bot id
         api_call = self.client.api_call('users.list')
         if api_call.get('ok'):
@@ -46,40 +105,124 @@ class Bot:
             print("could not find bot user with the name " + self.name)
             return None
 
+    def respond(self, text):
+        """
+        parses text and returns the matched groups and response text
+        """
+        return self.engine.respond(text)
+
     def handle_command(self, text, channel=''):
         """
         parses text and handles if valid command
         """
-        parsed = text.split(' ', 1)  # command and args (can be None)
-        groups, response = {}, ''
-        if len(parsed) == 1 and parsed[0] == 'help':  # help command takes no arguments
-            response = self.default_response()
-        elif len(parsed) == 2 and parsed[0] in self.commands:  # any valid command
-            cmmd, arg = parsed
-            dct = self.command_to_gid[cmmd]  # get target map
-            for key, gid in dct.items():
-                if arg.lower() in key.lower() and gid not in groups.keys():
-                    groups[gid] = self.gid_to_group[gid]
-
-            response = self.serializer.groups_response(groups)
-
-        else:  # invalid command
-            response = self.default_response()
-
         if not channel:  # for testing
+            groups, response = self.respond(text)
             return len(groups)
 
-        # post result as attachment
-        self.client.api_call("chat.postMessage",
-                             channel=channel,
+        self.handle_batch({text: [channel]})
+
+    def handle_batch(self, batch):
+        """
+        handles a batch of commands from parse_slack_batch, computing
+        each distinct command once and posting it to all its channels
+        """
+        for text, channels in batch.items():
+            posted = set()  # channels whose reply frees their slots once delivered
+            try:
+                self.handle_text(text, channels, posted)
+            finally:  # no reply is coming to the others, on error too
+                for channel in channels:
+                    if channel not in posted:
+                        self.release(text, channel)
+
+    def handle_text(self, text, channels, posted):
+        """ answers text in channels, adding each channel to posted once its reply is queued """
+        if text == 'reload':  # admin command, loads in the background
+            for channel in self.admin_channels.intersection(channels):
+                threading.Thread(target=self.reload, args=(channel,)).start()
+            channels = [c for c in channels if c not in self.admin_channels]
+        if text == 'more':  # next page of the channel's last result
+            for channel in channels:
+                self.post(channel, self.more(channel), self.release_on_delivery(text, channel))
+                posted.add(channel)
+            return
+        groups, response = self.respond(text)
+        for channel in channels:
+            self.post(channel, response, self.release_on_delivery(text, channel))
+            posted.add(channel)
+            if len(groups) > self.engine.page_size:
+                self.cursors.put(channel, self.snapshot.version,
+                                 (groups, self.engine.page_size))
+            else:
+                self.cursors.discard(channel)
+
+    def more(self, channel):
+        """ returns the next page of the last result posted to channel """
+        version = self.snapshot.version
+        cursor = self.cursors.get(channel, version)
+        if cursor is None:  # expired, exhausted or from older data
+            return 'Nothing more to show, please search again'
+        groups, start = cursor
+        if start + self.engine.page_size < len(groups):
+            self.cursors.put(channel, version, (groups, start + self.engine.page_size))
+        else:
+            self.cursors.discard(channel)
+        return self.engine.page(groups, start)
+
+    def admit(self, text, channel, user):
+        """ takes slots of channel and user for a request, or sheds it """
+        if not self.channel_admission.acquire(channel):
+            self.shed('channel')
+            return False
+        if user and not self.user_admission.acquire(user):
+            self.channel_admission.release(channel)
+            self.shed('user')
+            return False
+        with self.admitted_lock:
+            self.admitted.setdefault((text, channel), []).append(user)
+        return True
+
+    def shed(self, reason):
+        """ counts a request shed for its channel or user """
+        with self.admitted_lock:
+            self.stats['shed_' + reason] += 1
+        METRICS.inc('aptbot_shed_total', reason=reason)
+
+    def release(self, text, channel):
+        """ frees the slots of the oldest request of text in channel;
+        replies of a channel are delivered in order """
+        with self.admitted_lock:
+            users = self.admitted.get((text, channel))
+            if not users:
+                return
+            user = users.pop(0)
+            if not users:
+                del self.admitted[text, channel]
+        self.channel_admission.release(channel)
+        if user:
+            self.user_admission.release(user)
+
+    def release_on_delivery(self, text, channel):
+        """ returns a callback freeing the slots of text in channel """
+        return lambda: self.release(text, channel)
+
+    def post(self, channel, response, done=None):
+        """ queues result for delivery, in size-bounded chunks if it is long;
+        done() is called once the last chunk is delivered """
+        chunks = self.engine.serializer.chunks(response)
+        for idx, (text, blocks) in enumerate(chunks):
+            payload = {'blocks': blocks} if blocks else {}
+            self.outbox.send(channel,
+                             token=self.token,
+                             done=done if idx == len(chunks) - 1 else None,
                              username=self.name,
                              icon_emoji=self.emoji,
-                             text=response)
-        print('message attachment posted!')
+                             text=text,
+                             **payload)
 
     def default_response(self):
         """ returns default response """
-        return self.serializer.default_response(self.commands)
+        return self.engine.default_response()
 
     def parse_slack_output(self, slack_rtm_output):
         """
@@ -96,11 +239,39 @@ class Bot:
                            output['channel']
         return None, None
 
-    def run(self):
+    def parse_slack_batch(self, slack_rtm_output):
+        """
+            returns every message in a batch of rtm output directed at the
+            Bot, as a map from command text to the channels that sent it.
+            identical (channel, text) pairs are only kept once, and
+            messages of a channel or user with too many unanswered
+            requests are shed.
+        """
+        batch = OrderedDict()
+        for output in slack_rtm_output or []:
+            if output and 'text' in output and self.at_bot in output['text']:
+                text = output['text'].split(self.at_bot)[1].strip()
+                channels = batch.get(text, [])
+                if output['channel'] not in channels and \
+                        self.admit(text, output['channel'], output.get('user')):
+                    batch[text] = channels + [output['channel']]
+        return batch
+
+    def run(self, concurrency=8):
+        """ runs and processes slack output as soon as the socket is readable """
+        if self.connect():
+            print("APT bot connected and running as {}!".format(self.at_bot))
+            SnapshotWatcher(self.engine).start()
+            serve_from_env()
+            AsyncRunner(self, concurrency).run()
+        else:
+            print("Connection failed. Invalid Slack token or bot ID?")
+
+    def run_polling(self):
         """ runs and processes slack output in a lopp"""
         READ_WEBSOCKET_DELAY = 1  # 1 second delay between reading
 
-        if self.client.rtm_connect():
+        if self.connect():
             print("APT bot connected and running!")
             while True:
                 command, channel = self.parse_slack_output(self.client.rtm_read())
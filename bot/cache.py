@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# response cache for Aptbot
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """
+    Instantiates a group of calls in which concurrent calls with the same
+    key share one execution: the first caller runs it, the others wait for
+    its result.
+    """
+    def __init__(self):
+        self.calls = {}  # key -> [done event, result, exception]
+        self.lock = threading.Lock()
+        self.stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key, func):
+        """
+        returns the result of func() and False, or the result of a call
+        of key already running and True
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = [threading.Event(), None, None]
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+
+        try:
+            call[1] = func()
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call[0].set()
+        return call[1], False
+
+
+class ResponseCache:
+    """
+    Instantiates a bounded LRU cache of rendered responses.
+
+    Entries expire after ttl seconds and are tagged with the version of the
+    data snapshot they were rendered from, so loading a new snapshot
+    invalidates every older entry.
+    """
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (version, expiry, value)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def key(cmmd, arg):
+        """ returns the cache key of a command and its argument """
+        return cmmd, arg.strip().casefold()
+
+    def get(self, key, version):
+        """ returns the cached value for key, or None """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[2]
+            if entry:  # stale or expired
+                del self.entries[key]
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, version, value):
+        """ stores value for key, evicting the least recently used entry """
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def discard(self, key):
+        """ drops the entry for key, if any """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """ drops every entry """
+        with self.lock:
+            self.entries.clear()
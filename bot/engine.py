@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# query engine shared by every Aptbot connection in a process
+
+import pickle
+import sqlite3
+import threading
+from Serializer import Serializer
+from cache import ResponseCache, SingleFlight
+from snapshot import Snapshot
+from metrics import METRICS, SIZES
+from rank import Ranking
+from index import FIELDS
+import query
+
+PAGE_SIZE = 10  # groups per response, the rest are paged through with "more"
+
+
+class Engine:
+    """
+    Instantiates the read-only side of Aptbot: the data snapshot, its
+    response cache and the command parser. Bots of several workspaces can
+    share one Engine, so data and cache are held once per process.
+    """
+    def __init__(self, path='../data/', page_size=PAGE_SIZE):
+        self.serializer = Serializer()
+        self.commands = {
+            'group': 'information about the APT group(s) containing given name',
+            'tool': 'list of APT groups that use given tool',
+            'target': 'list of APT groups that target given asset or organization',
+            'ops': 'list of APT group that executed given operation',
+            'country': 'list of APT groups attributed to given country',
+            'query': 'groups matching conditions on group, tool, target, ops and '
+                     'country joined with AND, OR, NOT and parentheses, '
+                     'e.g. "country China AND tool PlugX AND target Japan"'
+        }
+        self.cache = ResponseCache()
+        self.flights = SingleFlight()
+        self.path = path
+        self.page_size = page_size
+        self.loaded = None  # Snapshot, loaded on the first query
+        self.reload_lock = threading.Lock()
+
+    @property
+    def snapshot(self):
+        """ returns the current data snapshot, loading it on first use """
+        if self.loaded is None:
+            with self.reload_lock:
+                if self.loaded is None:
+                    self.loaded = Snapshot(self.path)
+                    self.loaded.index.suggesters.start()
+        return self.loaded
+
+    def reload(self):
+        """
+        loads the data snapshot again and swaps it in, returning a report
+        of the load time and size delta; queries in flight finish on the
+        old snapshot
+        """
+        with self.reload_lock:
+            old = self.loaded
+            try:
+                # describe() reads the new index, so a broken one fails here
+                snapshot = Snapshot(self.path)
+                report = snapshot.describe(old)
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError,
+                    sqlite3.Error) as e:
+                report = 'reload failed, keeping current data: {}'.format(e)
+            else:
+                self.loaded = snapshot
+                snapshot.index.suggesters.start(old.index.suggesters if old else None)
+        print(report)
+        return report
+
+    def respond(self, text):
+        """
+        parses text and returns the matched groups and response text
+        """
+        parsed = text.split(' ', 1)  # command and args (can be None)
+        groups, response = {}, ''
+        if len(parsed) == 1 and parsed[0] == 'help':  # help command takes no arguments
+            METRICS.inc('aptbot_queries_total', command='help')
+            response = self.default_response()
+        elif len(parsed) == 2 and parsed[0] in self.commands:  # any valid command
+            METRICS.inc('aptbot_queries_total', command=parsed[0])
+            snapshot = self.snapshot  # answer from one snapshot throughout
+            plan = None
+            if parsed[0] == 'query':
+                try:
+                    plan = query.parse(parsed[1])
+                except ValueError as e:
+                    return groups, 'invalid query: {}'.format(e)
+                key = 'query', repr(plan)
+            else:
+                key = self.cache.key(*parsed)
+            cached = self.cache.get(key, snapshot.version)
+            if cached:
+                METRICS.inc('aptbot_cache_total', result='hit')
+                return cached
+
+            METRICS.inc('aptbot_cache_total', result='miss')
+            # identical requests arriving together share one answer
+            (groups, response), shared = self.flights.do(
+                (key, snapshot.version), lambda: self.answer(snapshot, key, plan))
+            if shared:
+                METRICS.inc('aptbot_coalesced_total')
+
+        else:  # invalid command
+            METRICS.inc('aptbot_queries_total', command='invalid')
+            response = self.default_response()
+
+        return groups, response
+
+    def answer(self, snapshot, key, plan=None):
+        """ computes, caches and returns the groups and response of a cache key """
+        cmmd = key[0]
+        with METRICS.span('lookup'):
+            if cmmd == 'query':
+                term_scores = []  # id -> score map of each term
+                scores = query.score(query.evaluate(plan, snapshot.index, term_scores),
+                                     term_scores)
+            else:
+                scores = snapshot.index.scores(*key)
+            # best matches first, ranked only as far as pages are shown
+            groups = Ranking(scores, snapshot.index)
+        METRICS.observe('aptbot_result_groups', len(groups), SIZES, command=cmmd)
+        with METRICS.span('serialize'):
+            response = snapshot.serializer.groups_response(groups, 0, self.page_size)
+        cacheable = True
+        if not groups and cmmd != 'query':  # likely a typo
+            with METRICS.span('suggest'):
+                suggestions = self.suggest(snapshot.index, *key)
+            if suggestions:
+                response = '\n'.join([response, snapshot.serializer.suggestions_response(
+                    cmmd, suggestions)])
+            # answer again once suggestions are built
+            cacheable = snapshot.index.suggesters.ready
+        if cacheable:
+            self.cache.put(key, snapshot.version, (groups, response))
+        return groups, response
+
+    @staticmethod
+    def suggest(index, cmmd, arg, limit=5):
+        """
+        returns keys close to an arg that matched nothing: the keys within
+        a typo or two, then the keys starting with its longest prefix that
+        some key starts with
+        """
+        suggestions = index.suggest(cmmd, arg, limit)
+        for end in range(len(arg) - 1, 2, -1):
+            if len(suggestions) >= limit:
+                break
+            completions = index.complete(cmmd, arg[:end], limit)
+            if completions:
+                suggestions += [key for key in completions if key not in suggestions]
+                break
+        return suggestions[:limit]
+
+    def complete(self, text, limit=25):
+        """
+        returns up to limit commands starting with text, for autocomplete:
+        command names, or keys of the command text starts with
+        """
+        with METRICS.span('complete'):
+            parsed = text.lstrip().split(' ', 1)
+            if len(parsed) == 1:  # still typing the command
+                return [cmmd for cmmd in self.commands if cmmd.startswith(parsed[0])][:limit]
+            cmmd, prefix = parsed
+            if cmmd not in FIELDS or not prefix.strip():
+                return []
+            return ['{} {}'.format(cmmd, key)
+                    for key in self.snapshot.index.complete(cmmd, prefix, limit)]
+
+    def page(self, groups, start):
+        """ returns the response for the page of groups from start """
+        METRICS.inc('aptbot_queries_total', command='more')
+        with METRICS.span('serialize'):
+            return self.snapshot.serializer.groups_response(groups, start, self.page_size)
+
+    def default_response(self):
+        """ returns default response """
+        return self.serializer.default_response(self.commands)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+#
+# Slack Events API mode for aptbot: the /listening endpoint only validates
+# and queues each event, then acks at once so Slack's 3-second deadline is
+# never at the mercy of a lookup or a post; worker threads answer them.
+#
+# run using: python events.py, with BOT_TOKEN and VERIFICATION_TOKEN set
+
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from flask import Flask, request, make_response, jsonify
+from bot import Bot
+from metrics import METRICS
+from snapshot import SnapshotWatcher
+
+
+class SeenSet:
+    """
+    Instantiates a bounded set of the most recent event ids, used to drop
+    the retries Slack sends when it did not see an ack in time.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, event_id):
+        """ adds event_id, returning False if it was already seen """
+        with self.lock:
+            if event_id in self.ids:
+                return False
+            self.ids[event_id] = None
+            if len(self.ids) > self.maxsize:
+                self.ids.popitem(last=False)
+            return True
+
+    def discard(self, event_id):
+        with self.lock:
+            self.ids.pop(event_id, None)
+
+
+class EventQueue:
+    """
+    Instantiates a bounded queue of Slack events drained by a pool of
+    worker threads that answer each event through the bot.
+    """
+    def __init__(self, bot, workers=8, maxsize=1000):
+        self.bot = bot
+        self.events = queue.Queue(maxsize)
+        self.seen = SeenSet()
+        self.stats = {'queued': 0, 'duplicates': 0, 'rejected': 0}
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def put(self, slack_event):
+        """ queues an event callback, returning False if it was dropped """
+        event_id = slack_event.get('event_id')
+        if event_id and not self.seen.add(event_id):
+            self.stats['duplicates'] += 1
+            return True  # already queued once, ack the retry
+        try:
+            self.events.put_nowait(slack_event['event'])
+        except queue.Full:
+            self.seen.discard(event_id)  # let Slack's retry through
+            self.stats['rejected'] += 1
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def work(self):
+        while True:
+            event = self.events.get()
+            try:
+                self.bot.handle_batch(self.bot.parse_slack_batch([event]))
+            except Exception as e:  # keep the worker alive
+                print('failed to handle event: {}'.format(e))
+            finally:
+                self.events.task_done()
+
+
+def create_app(bot, workers=8):
+    """ returns the Flask app serving Slack events for bot """
+    app = Flask(__name__)
+    app.events = EventQueue(bot, workers)
+    verification = os.environ.get('VERIFICATION_TOKEN')
+
+    @app.route("/listening", methods=["POST"])
+    def hears():
+        """
+        This route listens for incoming events from Slack, validates them
+        and queues them for the workers before acking.
+        """
+        try:
+            slack_event = json.loads(request.get_data(as_text=True))
+        except ValueError:
+            return make_response("invalid JSON", 400, {"X-Slack-No-Retry": 1})
+
+        # Slack checks our endpoint by sending a challenge token to echo back
+        #       For more info: https://api.slack.com/events/url_verification
+        if "challenge" in slack_event:
+            return make_response(slack_event["challenge"], 200,
+                                 {"content_type": "application/json"})
+
+        # verify the request is coming from Slack
+        if verification and verification != slack_event.get("token"):
+            return make_response("Invalid Slack verification token", 403,
+                                 {"X-Slack-No-Retry": 1})
+
+        if "event" not in slack_event:
+            return make_response("[NO EVENT IN SLACK REQUEST]", 404,
+                                 {"X-Slack-No-Retry": 1})
+
+        if not app.events.put(slack_event):  # full, Slack will retry later
+            return make_response("busy", 503)
+        return make_response("", 200)
+
+    @app.route("/options", methods=["POST"])
+    def options():
+        """
+        answers the options load URL of an external select menu with the
+        commands starting with what the user typed
+        """
+        try:
+            payload = json.loads(request.form.get("payload", ""))
+        except ValueError:
+            return make_response("invalid payload", 400)
+        if verification and verification != payload.get("token"):
+            return make_response("Invalid Slack verification token", 403)
+        completions = bot.engine.complete(payload.get("value", ""))
+        # option texts are limited to 75 characters, values to 150
+        return jsonify(options=[{"text": {"type": "plain_text", "text": text[:75]},
+                                 "value": text[:150]} for text in completions])
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """ serves latency histograms and counters to Prometheus """
+        return make_response(METRICS.render(), 200,
+                             {"Content-Type": "text/plain; version=0.0.4"})
+
+    return app
+
+
+if __name__ == '__main__':
+    bot = Bot()
+    SnapshotWatcher(bot.engine).start()
+    create_app(bot).run(port=int(os.environ.get('PORT', 3000)), threaded=True)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# typo tolerant "did you mean" suggestions for aptbot lookups
+
+import re
+import threading
+import time
+
+BUDGET = 0.02  # seconds a search may take before returning what it found
+MAX_TERM = 32  # longer keys are only suggested through their words
+WORDS = re.compile(r'\w{4,}')
+
+
+def levenshtein(a, b):
+    """ returns the edit distance of two strings """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+def max_distance(query):
+    """ returns the edit distance allowed for a query of its length """
+    if len(query) < 3:
+        return 0
+    return 1 if len(query) < 6 else 2
+
+
+class BKTree:
+    """
+    Instantiates a Burkhard-Keller tree over terms for edit distance search.
+
+    Every child of a node sits at a known distance from it, so by the
+    triangle inequality a search within k of query only descends into
+    children at distance d - k to d + k of each node it visits.
+    """
+    def __init__(self, terms):
+        self.root = None  # [term, {distance: child}]
+        self.size = 0
+        for term in terms:
+            self.add(term)
+
+    def add(self, term):
+        if self.root is None:
+            self.root = [term, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = levenshtein(term, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [term, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, query, k, deadline=None):
+        """ returns (distance, term) pairs within k of query, found before deadline """
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            if deadline and time.perf_counter() > deadline:
+                break
+            term, children = stack.pop()
+            d = levenshtein(query, term)
+            if d <= k:
+                found.append((d, term))
+            stack.extend(child for dist, child in children.items()
+                         if d - k <= dist <= d + k)
+        return found
+
+
+class Suggester:
+    """
+    Instantiates a suggestion index over the keys of one command.
+
+    Short keys are indexed whole and every key by its words, casefolded,
+    so "mimikats" finds "Mimikatz" and "defense" finds a long target list
+    mentioning "Defence". Given a completer, it also builds completer(keys)
+    for prefix completion of the same keys.
+    """
+    def __init__(self, keys, completer=None):
+        self.source = frozenset(keys)  # keys indexed, to reuse the index while they last
+        self.keys = {}  # term -> keys it stands for
+        for key in keys:
+            folded = key.strip().casefold()
+            terms = set(WORDS.findall(folded))
+            if len(folded) <= MAX_TERM:
+                terms.add(folded)
+            for term in terms:
+                self.keys.setdefault(term, []).append(key.strip())
+        self.tree = BKTree(self.keys)
+        self.completions = completer(keys) if completer else None
+
+    def suggest(self, query, limit=5, budget=BUDGET):
+        """ returns up to limit keys closest to query, best first """
+        query = query.strip().casefold()
+        k = max_distance(query)
+        if not k:
+            return []
+        found = self.tree.search(query, k, time.perf_counter() + budget)
+        # closest first, then the term nearest in length
+        found.sort(key=lambda pair: (pair[0], abs(len(pair[1]) - len(query)), pair[1]))
+        result = []
+        for _, term in found:
+            for key in sorted(self.keys[term], key=len):
+                if key not in result:
+                    result.append(key)
+        return result[:limit]
+
+
+class Suggesters:
+    """
+    Instantiates the suggestion indexes of the commands of a lookup index,
+    given a function returning the keys of a command, and optionally the
+    class of their completion indexes.
+
+    Building them takes seconds on large data, so they are built on one
+    background thread, reusing the indexes of a previous snapshot whose
+    keys did not change; until a command's index is built, it suggests
+    and completes nothing.
+    """
+    def __init__(self, keys, commands, completer=None):
+        self.keys = keys
+        self.commands = commands
+        self.completer = completer
+        self.built = {}  # cmmd -> Suggester
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self, previous=None):
+        """ starts building the indexes, once, taking what it can from previous """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.build, args=(previous,),
+                                               daemon=True)
+                self.thread.start()
+
+    def build(self, previous):
+        try:
+            for cmmd in self.commands:
+                keys = self.keys(cmmd)
+                old = previous.built.get(cmmd) if previous else None
+                if old is not None and old.source == frozenset(keys):
+                    self.built[cmmd] = old
+                else:
+                    self.built[cmmd] = Suggester(keys, self.completer)
+        except Exception as e:  # suggestions are only a convenience
+            print('could not build suggestions: {}'.format(e))
+
+    @property
+    def ready(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        """ waits until every index is built, returning whether they are """
+        self.start()
+        self.thread.join(timeout)
+        return self.ready
+
+    def suggest(self, cmmd, query, limit=5):
+        """ returns up to limit keys of cmmd closest to query, none while building """
+        self.start()
+        suggester = self.built.get(cmmd)
+        return suggester.suggest(query, limit) if suggester else []
+
+    def complete(self, cmmd, prefix, limit=10):
+        """ returns up to limit keys of cmmd starting with prefix, none while building """
+        self.start()
+        suggester = self.built.get(cmmd)
+        if suggester is None or suggester.completions is None:
+            return []
+        return suggester.completions.complete(prefix, limit)
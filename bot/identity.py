@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# on-disk cache of the bot user id resolved for a token
+
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'aptbot')  # or APTBOT_CACHE_DIR
+
+
+class IdentityCache:
+    """
+    Instantiates a cache mapping a hash of each token to its bot user id,
+    so restarts skip resolving the id through the Slack API.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(
+            os.environ.get('APTBOT_CACHE_DIR', CACHE_DIR), 'identity.json')
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, token):
+        """ returns the cached bot id of token, or None """
+        return self.load().get(self.key(token)) if token else None
+
+    def put(self, token, bot_id):
+        """ stores the bot id of token """
+        if not token or not bot_id:
+            return
+        ids = self.load()
+        ids[self.key(token)] = bot_id
+        f = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # a temporary file of its own, as other bots may write at once
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.path),
+                                             suffix='.tmp', delete=False) as f:
+                json.dump(ids, f)
+            os.replace(f.name, self.path)
+        except OSError as e:  # caching is only an optimization
+            print('could not cache bot id: {}'.format(e))
+            if f is not None and os.path.exists(f.name):
+                os.remove(f.name)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# substring search indexes over the command keys of aptbot
+
+import hashlib
+from array import array
+from bisect import bisect_left
+from fuzzy import Suggesters
+from rank import score_keys
+
+N = 3  # gram size
+SNAPSHOT_VERSION = 2  # bump whenever the command_to_gid.pkl layout changes
+COMMANDS = ('group', 'tool', 'target', 'ops')
+ATTRS = {'group': 'names', 'tool': 'tools',  # group attr searched by command
+         'target': 'targets', 'ops': 'operations'}
+FIELDS = COMMANDS + ('country',)  # country postings are derived from groups on load
+
+
+def check_groups(snapshot, data):
+    """
+    raises ValueError unless data is the groups.pkl the snapshot was saved
+    with, as a reader may open the two files while they are being replaced.
+    snapshots saved before the digest was kept are not checked
+    """
+    digest = snapshot.get('groups_sha256') if isinstance(snapshot, dict) else None
+    if digest is not None and digest != hashlib.sha256(data).hexdigest():
+        raise ValueError('groups.pkl does not match command_to_gid.pkl, '
+                         'they are being replaced')
+
+
+def union(postings):
+    """ returns the sorted union of sorted gid arrays """
+    result = set()
+    for posting in postings:
+        result.update(posting)
+    return array('I', sorted(result))
+
+
+def intersect(a, b):
+    """ returns the intersection of two sorted gid arrays """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) * 16 < len(b):  # skewed, binary search the long one
+        result, j = array('I'), 0
+        for x in a:
+            j = bisect_left(b, x, j)
+            if j == len(b):
+                break
+            if b[j] == x:
+                result.append(x)
+        return result
+
+    result, i, j = array('I'), 0, 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            result.append(a[i])
+            i, j = i + 1, j + 1
+    return result
+
+
+def difference(a, b):
+    """ returns the gids of sorted array a that are not in sorted array b """
+    exclude = set(b)
+    return array('I', (x for x in a if x not in exclude))
+
+
+def add_group(dct, idx, group):
+    """ adds the keys of group under interned id idx to a snapshot """
+    for cmmd, attr in ATTRS.items():
+        for key in group.get(attr, []):
+            posting = dct[cmmd].setdefault(key, array('I'))
+            if not posting or posting[-1] < idx:  # appending, ids ascending
+                posting.append(idx)
+            else:
+                pos = bisect_left(posting, idx)
+                if pos == len(posting) or posting[pos] != idx:
+                    posting.insert(pos, idx)
+
+
+def remove_group(dct, idx, group):
+    """ removes the keys group was added with under interned id idx """
+    for cmmd, attr in ATTRS.items():
+        for key in group.get(attr, []):
+            posting = dct[cmmd].get(key)
+            if posting is None:
+                continue
+            pos = bisect_left(posting, idx)
+            if pos < len(posting) and posting[pos] == idx:
+                del posting[pos]
+            if not posting:
+                del dct[cmmd][key]
+
+
+def build_snapshot(groups):
+    """ returns the command_to_gid snapshot of a gid -> group map """
+    dct = {cmmd: {} for cmmd in COMMANDS}
+    for idx, group in enumerate(groups.values()):
+        add_group(dct, idx, group)
+
+    dct['version'] = SNAPSHOT_VERSION
+    dct['gids'] = list(groups.keys())
+    return dct
+
+
+class TrigramIndex:
+    """
+    Instantiates a trigram index over a collection of string keys.
+
+    search(query) returns every key containing query, case-insensitively,
+    which is the same result as scanning `query.casefold() in key.casefold()`
+    over all keys, but only verifies keys sharing all trigrams of query.
+    """
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.folded = [key.casefold() for key in self.keys]
+        self.postings = {}  # trigram -> list of key ids, ascending
+        for kid, key in enumerate(self.folded):
+            for gram in set(self.grams(key)):
+                self.postings.setdefault(gram, []).append(kid)
+
+    @staticmethod
+    def grams(text):
+        """ returns all trigrams of text """
+        return [text[i:i + N] for i in range(len(text) - N + 1)]
+
+    def candidates(self, query):
+        """ returns ids of keys that contain every trigram of query """
+        grams = set(self.grams(query))
+        if not grams:  # query too short to use the index
+            return range(len(self.keys))
+
+        # intersect the rarest posting lists first
+        lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        result = set(lists[0])
+        for lst in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(lst)
+        return sorted(result)
+
+    def search(self, query):
+        """ returns all keys containing query """
+        query = query.casefold()
+        return [self.keys[kid] for kid in self.candidates(query)
+                if query in self.folded[kid]]
+
+
+class PrefixIndex:
+    """
+    Instantiates a sorted array of casefolded keys for prefix completion.
+
+    complete(prefix) bisects to the first key not below prefix and reads
+    forward while keys still start with it, in O(log n + prefix + limit).
+    """
+    def __init__(self, keys):
+        pairs = sorted({(key.strip().casefold(), key.strip()) for key in keys if key.strip()})
+        self.folded = [folded for folded, _ in pairs]
+        self.keys = [key for _, key in pairs]
+
+    def complete(self, prefix, limit=10):
+        """ returns up to limit keys starting with prefix, in order """
+        prefix = prefix.strip().casefold()
+        result = []
+        i = bisect_left(self.folded, prefix)
+        while i < len(self.folded) and len(result) < limit and \
+                self.folded[i].startswith(prefix):
+            if not result or result[-1] != self.keys[i]:
+                result.append(self.keys[i])
+            i += 1
+        return result
+
+
+class CommandIndex:
+    """
+    Instantiates the lookup index over a command_to_gid snapshot.
+
+    A snapshot maps each command to an inverted index of key -> sorted
+    array of interned gids, and holds the table of interned gid strings.
+    groups is the gid -> group map of groups.pkl. The few country keys
+    are indexed from groups when loading.
+    """
+    def __init__(self, snapshot, groups):
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('stale command_to_gid snapshot, '
+                             'rerun parser.py to rebuild it')
+        self.gids = snapshot['gids']  # interned id -> gid
+        if not groups.keys() >= set(self.gids):
+            raise ValueError('command_to_gid snapshot does not match groups')
+        self.groups = groups
+        self.postings = {cmmd: snapshot[cmmd] for cmmd in COMMANDS}
+        countries = self.postings['country'] = {}
+        for idx, gid in enumerate(self.gids):
+            country = groups[gid].get('country')
+            if country:
+                countries.setdefault(country, array('I')).append(idx)
+        self.indexes = {cmmd: TrigramIndex(dct)
+                        for cmmd, dct in self.postings.items()}
+        # suggestion and completion indexes, built in the background
+        self.suggesters = Suggesters(self.postings.get, tuple(self.postings), PrefixIndex)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def lookup(self, cmmd, arg):
+        """ returns the sorted interned ids of groups with a key containing arg """
+        dct = self.postings[cmmd]
+        return union(dct[key] for key in self.indexes[cmmd].search(arg))
+
+    def scores(self, cmmd, arg):
+        """ returns the relevance score of each interned id matching arg """
+        dct = self.postings[cmmd]
+        return score_keys(cmmd, arg, ((key, dct[key]) for key in self.indexes[cmmd].search(arg)))
+
+    def ids(self):
+        """ returns the interned ids of every group """
+        return array('I', range(len(self.gids)))
+
+    def resolve(self, ids):
+        """ returns the gid -> group map of interned ids """
+        return {self.gids[idx]: self.groups[self.gids[idx]] for idx in ids}
+
+    def find(self, cmmd, arg):
+        """ returns the gid -> group map of groups with a key containing arg """
+        return self.resolve(self.lookup(cmmd, arg))
+
+    def suggest(self, cmmd, arg, limit=5):
+        """ returns up to limit keys of cmmd closest to arg by edit distance """
+        return self.suggesters.suggest(cmmd, arg, limit)
+
+    def complete(self, cmmd, prefix, limit=10):
+        """ returns up to limit keys of cmmd starting with prefix """
+        return self.suggesters.complete(cmmd, prefix, limit)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# streaming ingestion of threat actor feeds into the aptbot data snapshot
+#
+# merge feeds into ../data/groups.pkl and ../data/command_to_gid.pkl with:
+#   python ingest.py actors.csv actors.jsonl enterprise-attack.json
+# a running bot reloads the merged snapshot by itself
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import pickle
+import re
+from index import SNAPSHOT_VERSION, COMMANDS, add_group, remove_group, check_groups
+
+LISTS = ('names', 'tools', 'targets', 'operations')  # attrs holding lists
+ROLES = {'id': 'id', 'gid': 'id', 'country': 'country',  # column -> group attr
+         'name': 'names', 'names': 'names', 'aliases': 'names',
+         'tools': 'tools', 'malware': 'tools', 'toolset / malware': 'tools',
+         'targets': 'targets', 'operations': 'operations', 'campaigns': 'operations'}
+READERS = {}  # file suffix -> reader yielding (gid, group) pairs
+SEPARATORS = re.compile(r'[\s,]*')  # between items of a JSON array
+
+
+def reader(*suffixes):
+    """ registers a reader function for files with suffixes """
+    def register(func):
+        for suffix in suffixes:
+            READERS[suffix] = func
+        return func
+    return register
+
+
+def read(path):
+    """ returns the stream of (gid, group) pairs of a feed file """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix not in READERS:
+        raise ValueError('no reader for {} files, known: {}'.format(
+            suffix, ', '.join(sorted(READERS))))
+    return READERS[suffix](path)
+
+
+def normalize(record, source, number):
+    """
+    returns the (gid, group) of a flat record in the shape parser.parse_apt
+    produces: list attrs split on ';', empty values dropped, other fields
+    kept as extra info. gids are namespaced by the source file.
+    """
+    group, ident = {}, None
+    for column, value in record.items():
+        # csv.DictReader puts the cells of rows longer than the header under None
+        if column is None or value is None or value == '' or value == []:
+            continue
+        role = ROLES.get(column.strip().lower(), column)
+        if role == 'id':
+            ident = value
+        elif role in LISTS:
+            values = value if isinstance(value, list) else str(value).split(';')
+            values = (str(v).strip() for v in values if v is not None)
+            group.setdefault(role, []).extend(v for v in values if v)
+        elif role == 'country':
+            group['country'] = str(value).strip()
+        else:
+            group[role] = value
+    return '{}:{}'.format(source, ident if ident is not None else number), group
+
+
+def source_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@reader('.xlsx')
+def read_xlsx(path):
+    """
+    streams the groups of a workbook in the layout of APT.xlsx, with gids
+    namespaced by the source file; the base APT.xlsx is built by parser.py
+    """
+    from parser import iter_apt  # needs pandas and openpyxl
+    source = source_name(path)
+    for gid, group in iter_apt(path):
+        yield '{}:{}'.format(source, gid), group
+
+
+@reader('.csv')
+def read_csv(path):
+    """ streams the rows of a CSV export with a header row """
+    source = source_name(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        for number, row in enumerate(csv.DictReader(f), 1):
+            yield normalize(row, source, number)
+
+
+@reader('.jsonl')
+def read_jsonl(path):
+    """ streams a JSON dump with one group object per line """
+    source = source_name(path)
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield normalize(json.loads(line), source, number)
+
+
+def iter_array(f, key, size=1 << 16):
+    """ yields the items of the array under key of a JSON file, reading it in chunks """
+    decoder = json.JSONDecoder()
+    buffer, pos = '', -1
+    while pos < 0:  # find the opening bracket of the array
+        chunk = f.read(size)
+        if not chunk:
+            return
+        buffer += chunk
+        pos = buffer.find('"{}"'.format(key))
+        if pos >= 0:
+            pos = buffer.find('[', pos)
+    pos += 1
+    while True:
+        pos = SEPARATORS.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:  # item continues in the next chunk
+            chunk = f.read(size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield item
+
+
+@reader('.json')
+def read_stix(path):
+    """
+    streams the intrusion sets and threat actors of a STIX 2 bundle.
+    Objects are read one at a time; only names and relationships are kept
+    until the bundle is read, as relationships may precede their objects.
+    """
+    actors, names, countries, relations = {}, {}, {}, []
+    with open(path, encoding='utf-8') as f:
+        for obj in iter_array(f, 'objects'):
+            kind, ident = obj.get('type'), obj.get('id')
+            if obj.get('revoked'):
+                continue
+            if kind in ('intrusion-set', 'threat-actor'):
+                group = {'names': [obj['name']] + [a for a in obj.get('aliases', [])
+                                                   if a != obj['name']]}
+                if obj.get('country'):
+                    group['country'] = obj['country']
+                if obj.get('description'):
+                    group['Description'] = obj['description']
+                links = [ref['url'] for ref in obj.get('external_references', [])
+                         if ref.get('url')]
+                for number, url in enumerate(links, 1):
+                    group['Link {}'.format(number)] = url
+                actors[ident] = group
+            elif kind == 'relationship':
+                relations.append((obj['source_ref'], obj['relationship_type'],
+                                  obj['target_ref']))
+            elif 'name' in obj or kind == 'location':  # tools, malware, identities, ...
+                if obj.get('name'):
+                    names[ident] = obj['name']
+                if kind == 'location' and obj.get('country'):
+                    countries[ident] = obj['country']
+
+    attrs = {('uses', 'tool'): 'tools', ('uses', 'malware'): 'tools',
+             ('targets', 'identity'): 'targets', ('targets', 'location'): 'targets',
+             ('targets', 'vulnerability'): 'targets'}
+    for source, relation, target in relations:
+        target_type = target.split('--')[0]
+        if source.split('--')[0] == 'campaign' and relation == 'attributed-to':
+            if target in actors and source in names:  # campaign of an actor
+                actors[target].setdefault('operations', []).append(names[source])
+        elif source in actors and relation in ('attributed-to', 'originates-from') \
+                and target_type == 'location':
+            # countries are named as in APT.xlsx, the ISO code is kept as extra info
+            name, code = names.get(target), countries.get(target)
+            if (name or code) and 'country' not in actors[source]:  # else not in the bundle
+                actors[source]['country'] = name or code
+                if code:
+                    actors[source]['Country code'] = code
+        elif source in actors and (relation, target_type) in attrs and target in names:
+            actors[source].setdefault(attrs[relation, target_type], []).append(names[target])
+
+    for ident, group in actors.items():
+        yield 'stix:{}'.format(ident), group
+
+
+def load(data):
+    """ returns the groups and command_to_gid snapshot in data, or empty ones """
+    try:
+        with open(data + 'groups.pkl', 'rb') as f:
+            pickled = f.read()
+        with open(data + 'command_to_gid.pkl', 'rb') as f:
+            dct = pickle.load(f)
+        check_groups(dct, pickled)
+        groups = pickle.loads(pickled)
+    except FileNotFoundError:
+        groups, dct = {}, {cmmd: {} for cmmd in COMMANDS}
+        dct['version'], dct['gids'] = SNAPSHOT_VERSION, []
+    if dct.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('stale command_to_gid snapshot, rerun parser.py to rebuild it')
+    return groups, dct
+
+
+def merge(groups, dct, records):
+    """
+    merges a stream of (gid, group) records into groups and its snapshot
+    in place: new gids are interned after the existing ones and appended
+    to their postings, known gids have their old keys replaced. returns
+    the counts of added and updated groups.
+    """
+    ids = {gid: idx for idx, gid in enumerate(dct['gids'])}
+    added = updated = 0
+    for gid, group in records:
+        idx = ids.get(gid)
+        if idx is None:
+            idx = ids[gid] = len(dct['gids'])
+            dct['gids'].append(gid)
+            added += 1
+        else:
+            remove_group(dct, idx, groups[gid])
+            updated += 1
+        groups[gid] = group
+        add_group(dct, idx, group)
+    return added, updated
+
+
+def save(data, groups, dct):
+    """
+    writes groups and snapshot aside and renames them into data. The
+    snapshot is renamed last and keeps the digest of the groups it was
+    built with, so a reader opening the files in between rejects the pair
+    instead of serving new groups from an old index.
+    """
+    pickled = pickle.dumps(groups)
+    dct['groups_sha256'] = hashlib.sha256(pickled).hexdigest()
+    tmp = '.{}.tmp'.format(os.getpid())
+    with open(data + 'groups.pkl' + tmp, 'wb') as f:
+        f.write(pickled)
+    with open(data + 'command_to_gid.pkl' + tmp, 'wb') as f:
+        pickle.dump(dct, f)
+    os.replace(data + 'groups.pkl' + tmp, data + 'groups.pkl')
+    os.replace(data + 'command_to_gid.pkl' + tmp, data + 'command_to_gid.pkl')
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='merge threat actor feeds into aptbot data')
+    argparser.add_argument('feeds', nargs='+', help='.xlsx, .csv, .jsonl or STIX 2 .json files')
+    argparser.add_argument('--data', default='../data/', help='snapshot directory')
+    args = argparser.parse_args()
+
+    groups, dct = load(args.data)
+    for feed in args.feeds:
+        added, updated = merge(groups, dct, read(feed))
+        print('{}: {} groups added, {} updated'.format(feed, added, updated))
+    save(args.data, groups, dct)
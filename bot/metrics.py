@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# latency histograms and counters for Aptbot, in Prometheus text format
+#
+# export APTBOT_METRICS_PORT to serve them on http://127.0.0.1:<port>/metrics
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds, fine at the low end where lookups land
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZES = (0, 1, 2, 5, 10, 20, 50, 100, 200)  # groups per result
+
+
+class Histogram:
+    """
+    Instantiates a cumulative histogram over fixed bucket upper bounds.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        """ returns (le, cumulative count) pairs, the sum and the count """
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, result = 0, []
+        for le, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            result.append((le, cumulative))
+        return result, total, cumulative
+
+
+class Span:
+    """ times a with block into a histogram """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """
+    Instantiates a set of labelled histograms and counters.
+
+    Every metric is created on first use, so recording costs a dict lookup,
+    a bisect and an uncontended lock.
+    """
+    def __init__(self):
+        self.help = {}  # name -> (type, help text)
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> value
+        self.lock = threading.Lock()
+        self.server = None  # set by serve_from_env
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def histogram(self, name, buckets=BUCKETS, **labels):
+        """ returns the histogram of name with labels, creating it """
+        key = name, label_key(labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def span(self, stage):
+        """ returns a context manager timing stage into aptbot_stage_seconds """
+        return Span(self.histogram('aptbot_stage_seconds', stage=stage))
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        self.histogram(name, buckets, **labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = name, label_key(labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def value(self, name, **labels):
+        """ returns the value of a counter """
+        return self.counters.get((name, label_key(labels)), 0)
+
+    def render(self):
+        """ returns every metric in the Prometheus text exposition format """
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: str(item[0]))
+            counters = sorted(self.counters.items(), key=lambda item: str(item[0]))
+        lines, named = [], set()
+
+        def header(name, kind):
+            if name not in named:
+                named.add(name)
+                text = self.help.get(name, (kind, name))[1]
+                lines.append('# HELP {} {}'.format(name, text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            buckets, total, count = histogram.samples()
+            for le, cumulative in buckets:
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', le),)), cumulative))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """ serves /metrics on a background thread, returning the server """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def label_key(labels):
+    """ returns labels as sorted pairs, with string values so keys always sort """
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                           .replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def serve_from_env():
+    """ serves METRICS if APTBOT_METRICS_PORT is set, once per process """
+    port = os.environ.get('APTBOT_METRICS_PORT')
+    if port and METRICS.server is None:
+        METRICS.server = METRICS.serve(int(port))
+        print('metrics served on http://127.0.0.1:{}/metrics'.format(port))
+
+
+METRICS = Registry()  # the process-wide registry
+METRICS.describe('aptbot_stage_seconds', 'histogram',
+                 'time spent per stage: rtm_read, lookup, serialize, post, queue')
+METRICS.describe('aptbot_queries_total', 'counter', 'queries answered per command')
+METRICS.describe('aptbot_result_groups', 'histogram', 'groups matched per lookup')
+METRICS.describe('aptbot_cache_total', 'counter', 'response cache hits and misses')
+METRICS.describe('aptbot_api_errors_total', 'counter',
+                 'failed chat.postMessage calls by kind')
+METRICS.describe('aptbot_events_total', 'counter', 'rtm events read')
+METRICS.describe('aptbot_coalesced_total', 'counter',
+                 'requests answered by an identical request already running')
+METRICS.describe('aptbot_shed_total', 'counter',
+                 'requests dropped for too many unanswered ones per channel or user')
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# outbound message delivery for Aptbot
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import METRICS
+
+SLACK_API = 'https://slack.com/api/'
+
+
+class TokenBucket:
+    """
+    Instantiates a token bucket allowing `rate` messages per second with
+    bursts of up to `capacity` messages.
+    """
+    def __init__(self, rate=1.0, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # set from Retry-After
+
+    def delay(self, now):
+        """ returns seconds until a token is available, taking it if it is """
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, now, seconds):
+        """ holds back the bucket for seconds, as asked by a 429 """
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class Outbox:
+    """
+    Instantiates a background delivery queue for chat.postMessage.
+
+    Messages are sent off the query path by a pool of worker threads
+    sharing one pooled HTTP session. Each channel of each workspace token
+    keeps its own FIFO and token bucket, honoring Slack's one message per second limit and any
+    Retry-After it answers with, and has at most one message in flight so
+    its messages arrive in order. Failed sends are retried with
+    exponential backoff.
+    """
+    def __init__(self, token, workers=4, rate=1.0, burst=1, retries=5,
+                 backoff=0.5, session=None, url=SLACK_API):
+        self.token = token
+        self.rate, self.burst = rate, burst
+        self.retries, self.backoff = retries, backoff
+        self.url = url + 'chat.postMessage'
+        self.session = session or self.pooled_session(workers)
+        # messages are queued per (token, channel) key
+        self.queues = {}  # key -> deque of [attempt, enqueued time, payload, done]
+        self.buckets = {}  # key -> TokenBucket
+        self.ready = []  # heap of (due time, seq, key) with queued messages
+        self.scheduled = set()  # keys in ready or in flight
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.stats = {'sent': 0, 'retried': 0, 'rate_limited': 0, 'failed': 0}
+        self.latencies = deque(maxlen=1000)  # enqueue -> delivered, seconds
+        self.workers = [threading.Thread(target=self.work, daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    @staticmethod
+    def pooled_session(size):
+        """ returns a session keeping up to size connections to Slack alive """
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=size))
+        return session
+
+    def send(self, channel, token=None, done=None, **payload):
+        """ queues a message for channel, posted with token or the outbox's
+        own, and returns immediately; done() is called once it is delivered
+        or dropped """
+        payload['channel'] = channel
+        payload['token'] = token or self.token
+        key = payload['token'], channel
+        now = time.monotonic()
+        with self.cond:
+            self.queues.setdefault(key, deque()).append([0, now, payload, done])
+            if key not in self.scheduled:
+                self.schedule(key, now)
+
+    def schedule(self, key, due):
+        """ marks key as having a message due; caller holds cond """
+        self.scheduled.add(key)
+        heapq.heappush(self.ready, (due, next(self.seq), key))
+        self.cond.notify()
+
+    def flush(self, timeout=None):
+        """ waits until every queued message is delivered or dropped """
+        deadline = timeout and time.monotonic() + timeout
+        with self.cond:
+            while self.scheduled:
+                remaining = deadline and deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def next_message(self):
+        """ blocks until a channel is due and has a token, returning its head """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.ready and self.ready[0][0] <= now:
+                    _, _, key = heapq.heappop(self.ready)
+                    bucket = self.buckets.setdefault(
+                        key, TokenBucket(self.rate, self.burst))
+                    wait = bucket.delay(now)
+                    if wait:
+                        heapq.heappush(self.ready, (now + wait, next(self.seq), key))
+                        continue
+                    return self.queues[key][0]
+                self.cond.wait(self.ready[0][0] - now if self.ready else None)
+
+    def work(self):
+        """ delivers queued messages until the process exits """
+        while True:
+            message = self.next_message()
+            attempt, enqueued, payload, done = message
+            key = payload['token'], payload['channel']
+            try:
+                retry_after = self.deliver(payload, attempt)
+            except Exception as e:  # keep the worker alive
+                print('chat.postMessage failed: {}'.format(e))
+                retry_after = self.backoff * 2 ** attempt * random.uniform(1, 2)
+            with self.cond:
+                now = time.monotonic()
+                queue = self.queues[key]
+                if retry_after is not None and attempt < self.retries:
+                    self.stats['retried'] += 1
+                    message[0] += 1
+                    self.schedule(key, now + retry_after)
+                    continue
+
+                queue.popleft()
+                if retry_after is None:
+                    self.stats['sent'] += 1
+                    self.latencies.append(now - enqueued)
+                    METRICS.observe('aptbot_stage_seconds', now - enqueued, stage='queue')
+                else:
+                    self.stats['failed'] += 1
+                    print('dropped message to {} after {} attempts'.format(
+                        payload['channel'], attempt + 1))
+                if queue:
+                    self.schedule(key, now)
+                else:
+                    del self.queues[key]
+                    self.scheduled.discard(key)
+                self.cond.notify_all()
+            if done:
+                try:
+                    done()
+                except Exception as e:  # keep the worker alive
+                    print('delivery callback failed: {}'.format(e))
+
+    def deliver(self, payload, attempt=0):
+        """ posts payload, returning None or the seconds to wait before a retry """
+        try:
+            with METRICS.span('post'):
+                response = self.session.post(self.url, timeout=10,
+                                             data=payload)
+        except requests.RequestException as e:
+            print('chat.postMessage failed: {}'.format(e))
+            METRICS.inc('aptbot_api_errors_total', kind='network')
+            return self.backoff * 2 ** attempt * random.uniform(1, 2)
+
+        if response.status_code != 200:
+            METRICS.inc('aptbot_api_errors_total', kind=str(response.status_code))
+        if response.status_code == 429:
+            retry_after = float(response.headers.get('Retry-After', 1))
+            with self.cond:
+                self.stats['rate_limited'] += 1
+                key = payload['token'], payload['channel']
+                self.buckets[key].block(time.monotonic(), retry_after)
+            return retry_after
+        if response.status_code >= 500:
+            return self.backoff * 2 ** attempt * random.uniform(1, 2)
+        try:
+            body = response.json()
+        except ValueError:  # an HTML error page, say
+            print('chat.postMessage answered {} without JSON'.format(response.status_code))
+            METRICS.inc('aptbot_api_errors_total', kind='decode')
+            return self.backoff * 2 ** attempt * random.uniform(1, 2)
+        if not body.get('ok'):
+            METRICS.inc('aptbot_api_errors_total', kind=body.get('error'))
+            print('chat.postMessage error: {}'.format(body.get('error')))
+        return None
@@ -4,11 +4,20 @@
 
 import openpyxl as xl
 import pandas as pd
-import pickle
+from index import build_snapshot
+from ingest import save
 from pprint import pprint
 
-def parse_apt():
-    """ parses APT data to a list of APT groups
+def parse_apt(path='../data/APT.xlsx'):
+    """ parses APT data to a map from gid to APT group, see iter_apt """
+    return dict(iter_apt(path))
+
+
+def iter_apt(path='../data/APT.xlsx'):
+    """ parses APT data to a stream of (gid, APT group) pairs
+
+    the workbook is opened once in read-only mode and streamed sheet by
+    sheet, so only one sheet is held in memory at a time.
 
     example of an APT group in the list:
 
@@ -23,83 +32,101 @@ def parse_apt():
     ]
     """
 
+    def column_role(col_name):
+        """helper to classify a column title to the group attr it fills"""
+        if pd.isnull(col_name):
+            return None
+        if 'Name' in col_name:
+            return 'names'
+        elif col_name == 'Toolset / Malware':
+            return 'tools'
+        elif col_name == 'Targets':
+            return 'targets'
+        elif 'Operation' in col_name:
+            return 'operations'
+        else:  # if no match, add as extra info
+            return col_name
+
     def parse_sheet(sheet, sheetname, sheet_idx):
-        """helper to parse dataframe sheet argument to a group dict"""
+        """helper to parse dataframe sheet argument to (gid, group) pairs"""
 
         # set col names
         sheet.columns = sheet.iloc[0]
         sheet = sheet[2:]
 
-        for row_idx, row in sheet.iterrows():
+        # classify each column once and transform its values column-wise
+        # into per-row (attr, value) pairs, None where the cell is empty
+        columns = []
+        for pos, col_name in enumerate(sheet.columns):
+            role = column_role(col_name)
+            if role is None:
+                continue
+            col = sheet.iloc[:, pos]
+            present = col.notnull()
+            if role == 'names':  # unsure names are kept as extra info
+                unsure = col.str.startswith('?').fillna(False).astype(bool)
+                attrs = unsure.map({True: col_name, False: role})
+            else:
+                attrs = pd.Series(role, index=col.index)
+            if role in ('tools', 'targets'):
+                col = col.str.split(',')
+            pairs = pd.Series(list(zip(attrs, col)), index=col.index)
+            columns.append(pairs.where(present, None).tolist())
+
+        # every row is a group, even in a sheet without classified columns
+        for pos, row_idx in enumerate(sheet.index):
+            cells = [column[pos] for column in columns]
             group = {}
             group['country'] = sheetname
             group['names'], group['operations'] = [], []
 
-            # iterate over each col to fill matching attrs
-            for col_name in row.index:
-                if pd.isnull(col_name) or pd.isnull(row[col_name]):
+            for cell in cells:
+                if cell is None:
                     continue
-                val = row[col_name]
-
-                # for each column, parse column title and value
-                if 'Name' in col_name and not val.startswith('?'):
-                    group['names'].append(val)
-                elif col_name == 'Toolset / Malware':
-                    group['tools'] = val.split(',')
-                elif col_name == 'Targets':
-                    group['targets'] = val.split(',')
-                elif 'Operation' in col_name:
-                    group['operations'].append(val)
-                else:  # if no match, add as extra info
-                    group[col_name] = val
+                attr, val = cell
+                if attr in ('names', 'operations'):
+                    group[attr].append(val)
+                else:
+                    group[attr] = val
 
             if not group['operations']:  # remove if no ops
                 group.pop('operations', None)
 
-            # store in map from gid to group
+            # gid is the sheet and row of the group
             gid = '_'.join([str(sheet_idx), str(row_idx)])
-            groups[gid] = group
+            yield gid, group
 
-    path = '../data/APT.xlsx'
-    groups = {}
+    def read_sheet(worksheet):
+        """helper to read a worksheet to a dataframe like pd.read_excel"""
+        rows = list(worksheet.values)
+        while rows and all(pd.isnull(val) for val in rows[-1]):
+            rows.pop()  # read-only sheets may report trailing empty rows
+        return pd.DataFrame(rows[1:])  # first row is the skipped header
 
     # parse each sheet in workbook using helper
-    book = xl.load_workbook(path)
-    for sheet_idx, sheetname in enumerate(book.sheetnames):
-        if sheetname != 'Home' and sheetname[0] != '_':
-            sheet = pd.read_excel(path, sheetname=sheetname)
-            parse_sheet(sheet, sheetname, sheet_idx)
-
-    return groups
+    book = xl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet_idx, sheetname in enumerate(book.sheetnames):
+            if sheetname != 'Home' and sheetname[0] != '_':
+                yield from parse_sheet(read_sheet(book[sheetname]), sheetname, sheet_idx)
+    finally:
+        book.close()
 
 
 def map_command_to_gid(groups):
-    """ create second map from command arg to gid """
-    dct = {'group': {}, 'tool': {}, 'target': {}, 'ops': {}}
-    for gid, group in groups.items():
-        # bad code... embed this in parse_sheet()
-        if 'names' in group.keys():
-            for name in group['names']:
-                dct['group'][name] = gid
-        if 'tools' in group.keys():
-            for tool in group['tools']:
-                dct['tool'][tool] = gid
-        if 'targets' in group.keys():
-            for target in group['targets']:
-                dct['target'][target] = gid
-        if 'operations' in group.keys():
-            for op in group['operations']:
-                dct['ops'][op] = gid
-
-    return dct
+    """ create second map from command arg to the sorted ids of all its groups
+
+    gids are interned to small integers in the order of groups; the
+    snapshot stores the table to map them back to gid strings.
+    """
+    return build_snapshot(groups)
+
 
 if __name__ == "__main__":
     groups = parse_apt()
     dct = map_command_to_gid(groups)
-    with open('../data/groups.pkl', 'wb') as f:
-        pickle.dump(groups, f)
-    with open('../data/command_to_gid.pkl', 'wb') as f:
-        pickle.dump(dct, f)
+    # write aside and rename so a running bot never reads half a file
+    save('../data/', groups, dct)
     # pprint(groups)
     # pprint(dct)
 
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# compound queries over the lookup indexes of aptbot
+#
+#   country China AND tool PlugX AND NOT (target Japan OR target Korea)
+#
+# operators are upper case, since keys contain words like 'and'; values
+# with parentheses or quotes in them can be quoted: target "Energy (OpNightDragon)"
+
+import re
+from array import array
+from index import FIELDS, intersect, union, difference
+
+TOKENS = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+OPERATORS = ('AND', 'OR', 'NOT', '(', ')')
+
+
+def tokenize(text):
+    """ returns the words, quoted values and parentheses of text """
+    if text.count('"') % 2:
+        raise ValueError('unbalanced quotes')
+    return TOKENS.findall(text)
+
+
+def parse(text):
+    """
+    returns the plan of a query: a ('term', field, value), ('not', node),
+    ('and', nodes) or ('or', nodes) tuple, with values casefolded so equal
+    queries have equal plans. NOT binds tightest, then AND, then OR.
+    """
+    tokens = tokenize(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def expression(op, operand):
+        nodes = [operand()]
+        while peek() == op.upper():
+            take()
+            nodes.append(operand())
+        # flatten a AND (b AND c) into one node
+        flat = []
+        for node in nodes:
+            flat.extend(node[1] if node[0] == op else [node])
+        return flat[0] if len(flat) == 1 else (op, tuple(flat))
+
+    def disjunction():
+        return expression('or', conjunction)
+
+    def conjunction():
+        return expression('and', unary)
+
+    def unary():
+        token = peek()
+        if token == 'NOT':
+            take()
+            return 'not', unary()
+        if token == '(':
+            take()
+            node = disjunction()
+            if peek() != ')':
+                raise ValueError('missing )')
+            take()
+            return node
+        if token not in FIELDS:
+            raise ValueError('expected one of {} but got {}'.format(
+                ', '.join(FIELDS), token or 'end of query'))
+        take()
+        words = []
+        while peek() is not None and peek() not in OPERATORS:
+            words.append(take().strip('"'))
+        value = ' '.join(words).strip().casefold()
+        if not value:
+            raise ValueError('{} needs a value'.format(token))
+        return 'term', token, value
+
+    node = disjunction()
+    if peek() is not None:
+        raise ValueError('unexpected {}'.format(peek()))
+    return node
+
+
+def evaluate(node, index, scores=None):
+    """
+    returns the sorted ids of groups matching a plan, from an index with
+    lookup(field, value) and ids() like CommandIndex or SqliteIndex; given
+    a scores list, the id -> score map of every term not under a NOT is
+    appended to it
+    """
+    kind = node[0]
+    if kind == 'term':
+        if scores is None:
+            return index.lookup(node[1], node[2])
+        term_scores = index.scores(node[1], node[2])
+        scores.append(term_scores)
+        return array('I', sorted(term_scores))
+    if kind == 'not':
+        return difference(index.ids(), evaluate(node[1], index))
+    if kind == 'or':
+        return union(evaluate(child, index, scores) for child in node[1])
+    return conjoin(node[1], index, scores)
+
+
+def score(ids, scores):
+    """ returns the id -> summed term score map of ids """
+    return {idx: sum(term_scores.get(idx, 0) for term_scores in scores) for idx in ids}
+
+
+def conjoin(nodes, index, scores=None):
+    """
+    returns the intersection of nodes: single lookups are intersected
+    smallest first, then nested expressions and negations, stopping as
+    soon as the result is empty
+    """
+    terms = [node for node in nodes if node[0] == 'term']
+    nested = [node for node in nodes if node[0] not in ('term', 'not')]
+    negated = [node[1] for node in nodes if node[0] == 'not']
+
+    postings = []
+    for term in terms:
+        posting = evaluate(term, index, scores)
+        if not posting:
+            return array('I')
+        postings.append(posting)
+    postings.sort(key=len)
+
+    result = postings[0] if postings else None
+    for posting in postings[1:]:
+        result = intersect(result, posting)
+        if not result:
+            return result
+    for node in nested:
+        result = evaluate(node, index, scores) if result is None else \
+            intersect(result, evaluate(node, index, scores))
+        if not result:
+            return result
+    if result is None:  # only negations
+        result = index.ids()
+    for node in negated:
+        result = difference(result, evaluate(node, index))
+        if not result:
+            break
+    return result
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# relevance ranking of aptbot lookups
+
+import heapq
+import re
+import threading
+from collections.abc import Mapping
+
+# how a key matched, best first
+EXACT, PREFIX, TOKEN, SUBSTRING = 8, 4, 2, 1
+WEIGHTS = {'group': 4, 'tool': 2, 'ops': 2, 'target': 1, 'country': 1}
+SELECT = 10  # groups ranked at a time
+
+
+def match_score(key, arg):
+    """ returns how well casefolded arg matches a key containing it """
+    key = key.strip().casefold()
+    if key == arg:
+        return EXACT
+    if key.startswith(arg):
+        return PREFIX
+    if re.search(r'(?<!\w){}(?!\w)'.format(re.escape(arg)), key):
+        return TOKEN
+    return SUBSTRING
+
+
+def score_keys(cmmd, arg, matches):
+    """
+    returns the id -> score map of (key, ids) matches of arg, scoring each
+    group by its best matching key weighted by the field of cmmd
+    """
+    arg = arg.strip().casefold()
+    weight = WEIGHTS[cmmd]
+    scores = {}
+    for key, ids in matches:
+        score = match_score(key, arg) * weight
+        for idx in ids:
+            if scores.get(idx, 0) < score:
+                scores[idx] = score
+    return scores
+
+
+class Ranking(Mapping):
+    """
+    Instantiates the gid -> group map of scored ids of an index, iterating
+    groups best first (ties in index order).
+
+    Groups are selected from the remaining ids with a bounded heap, a few
+    at a time as iteration needs them, so showing the first page never
+    sorts or resolves the whole candidate set.
+    """
+    def __init__(self, scores, index):
+        self.scores = scores  # id -> score
+        self.index = index
+        self.ordered = []  # (gid, group) selected so far, best first
+        self.selected = {}  # gid -> group selected so far
+        self.rest = list(scores)
+        self.lock = threading.Lock()  # rankings are shared through caches
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, count):
+        """ ranks the next count groups, returning False once all are """
+        with self.lock:
+            if not self.rest:
+                return False
+            scores = self.scores
+            best = heapq.nsmallest(count, self.rest, key=lambda idx: (-scores[idx], idx))
+            chosen = set(best)
+            self.rest = [idx for idx in self.rest if idx not in chosen]
+            best_ids = sorted(best)  # resolve returns groups in id order
+            gids = dict(zip(best_ids, self.index.resolve(best_ids).items()))
+            for idx in best:
+                self.ordered.append(gids[idx])
+                self.selected[gids[idx][0]] = gids[idx][1]
+            return True
+
+    def __iter__(self):
+        position, count = 0, SELECT
+        while True:
+            if position == len(self.ordered):
+                self.select(count)
+                count *= 2  # whole result wanted, select in growing steps
+                if position == len(self.ordered):
+                    return
+            yield self.ordered[position][0]
+            position += 1
+
+    def __getitem__(self, gid):
+        while gid not in self.selected and self.select(len(self.scores)):
+            pass
+        return self.selected[gid]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# compact in-memory group records for Aptbot
+
+import sys
+from collections.abc import Mapping
+
+FIXED = ('country', 'names', 'tools', 'targets', 'operations')
+
+
+class Layout:
+    """
+    Instantiates the shared column table of records with the same keys.
+    keys holds every attribute in its original order; extra columns such
+    as 'Link 1' or 'Mandiant' are stored once here instead of per group.
+    """
+    __slots__ = ('keys', 'extras')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.extras = {key: idx for idx, key in
+                       enumerate(k for k in keys if k not in FIXED)}
+
+
+class GroupRecord(Mapping):
+    """
+    Instantiates a read-only group with the same items as a group dict of
+    parser.parse_apt, holding the fixed fields in slots, list values as
+    tuples of interned strings and extra info as a tuple of values whose
+    column names live in a shared Layout.
+    """
+    __slots__ = ('country', 'names', 'tools', 'targets', 'operations',
+                 'layout', 'values')
+
+    layouts = {}  # keys -> Layout, shared by all records
+
+    def __init__(self, group):
+        keys = tuple(sys.intern(key) for key in group)
+        layout = self.layouts.get(keys)
+        if layout is None:
+            layout = self.layouts[keys] = Layout(keys)
+        self.layout = layout
+        for attr in FIXED:
+            val = group.get(attr)
+            if isinstance(val, list):
+                val = tuple(intern(v) for v in val)
+            else:
+                val = intern(val)
+            setattr(self, attr, val)
+        self.values = tuple(intern(group[key]) for key in layout.extras)
+
+    def __getitem__(self, key):
+        if key in FIXED:
+            val = getattr(self, key)
+            if val is not None or key in self.layout.keys:
+                return val
+        elif key in self.layout.extras:
+            return self.values[self.layout.extras[key]]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.layout.keys)
+
+    def __len__(self):
+        return len(self.layout.keys)
+
+    def items(self):
+        """ returns (key, value) pairs in the original column order """
+        values = iter(self.values)
+        return [(key, getattr(self, key) if key in FIXED else next(values))
+                for key in self.layout.keys]
+
+    def __reduce__(self):
+        return GroupRecord, (dict(self.items()),)
+
+
+def intern(val):
+    """ interns strings, leaving other values as they are """
+    return sys.intern(val) if isinstance(val, str) else val
+
+
+def compact(groups):
+    """ returns a gid -> GroupRecord copy of a gid -> group dict """
+    return {sys.intern(gid): GroupRecord(group) for gid, group in groups.items()}
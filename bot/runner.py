@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# asyncio event loop for Aptbot
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from metrics import METRICS
+
+
+class AsyncRunner:
+    """
+    Instantiates an asyncio runner that reads the RTM socket of a Bot
+    whenever it becomes readable and handles each command on a bounded
+    pool of worker threads, so a slow chat.postMessage never blocks the
+    next read. Runners of several bots may share one executor.
+    """
+    def __init__(self, bot, concurrency=8, executor=None):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.shared = executor is not None
+        self.executor = executor or ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = None  # semaphore, created inside the running loop
+        self.pending = set()
+
+    def run(self):
+        """ runs the event loop until the connection closes """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """ waits on socket readiness and dispatches every command read """
+        loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        readable = asyncio.Event()
+        sock = self.bot.client.server.websocket.sock
+        loop.add_reader(sock.fileno(), readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                # drain: TLS may buffer several frames behind one wakeup,
+                # and a burst is answered as one batch
+                output = []
+                with METRICS.span('rtm_read'):
+                    while True:
+                        events = self.bot.client.rtm_read()
+                        if not events:
+                            break
+                        output.extend(events)
+                METRICS.inc('aptbot_events_total', len(output))
+                self.dispatch(output)
+        finally:
+            loop.remove_reader(sock.fileno())
+            if self.pending:
+                await asyncio.wait(self.pending)
+            if not self.shared:
+                self.executor.shutdown(wait=False)
+
+    def dispatch(self, output):
+        """ schedules one handler per distinct command in a batch of rtm output """
+        for command, channels in self.bot.parse_slack_batch(output).items():
+            task = asyncio.ensure_future(self.handle(command, channels))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def handle(self, command, channels):
+        """ runs a blocking handle_batch once a worker slot is free """
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self.executor, self.bot.handle_batch,
+                                           {command: channels})
+            except Exception as e:  # keep serving other commands
+                print('failed to handle {!r}: {}'.format(command, e))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# loading and hot reloading of Aptbot data snapshots
+
+import os
+import pickle
+import threading
+import time
+from Serializer import Serializer
+from index import CommandIndex, check_groups
+from store import SqliteIndex
+from records import compact
+
+
+def data_files(path):
+    """ returns the files a snapshot in path is loaded from """
+    database = os.environ.get('APTBOT_DB')
+    if database:
+        return [database]
+    return [path + 'groups.pkl', path + 'command_to_gid.pkl']
+
+
+def file_version(files):
+    """ returns the (mtime, size) of each file """
+    return tuple((stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, files))
+
+
+class Snapshot:
+    """
+    Instantiates an immutable view of the data in path: its lookup index,
+    a Serializer holding fragments of its groups only, and the version
+    cached responses are tagged with. Bot swaps whole snapshots, so a
+    query that started on one finishes on it.
+
+    if APTBOT_DB names a database built by store.py, queries are answered
+    from it instead of unpickling groups.pkl and command_to_gid.pkl
+    """
+    def __init__(self, path):
+        start = time.perf_counter()
+        self.files = data_files(path)
+        self.version = file_version(self.files)
+        if os.environ.get('APTBOT_DB'):
+            self.index = SqliteIndex(self.files[0])
+        else:
+            with open(self.files[0], 'rb') as f:
+                data = f.read()
+            with open(self.files[1], 'rb') as f:
+                snapshot = pickle.load(f)
+            check_groups(snapshot, data)
+            gid_to_group = compact(pickle.loads(data))  # dict of groups
+            self.index = CommandIndex(snapshot, gid_to_group)
+        self.serializer = Serializer()
+        self.size = sum(size for _, size in self.version)
+        self.load_time = time.perf_counter() - start
+
+    def describe(self, old):
+        """ returns a report of swapping old for this snapshot """
+        return 'loaded data in {:.2f}s: {} -> {} groups, {:.1f} -> {:.1f} kB'.format(
+            self.load_time, len(old.index) if old else 0, len(self.index),
+            old.size / 1000 if old else 0, self.size / 1000)
+
+
+class SnapshotWatcher(threading.Thread):
+    """
+    Instantiates a thread that polls the data files of an Engine and
+    reloads them once they changed and have not been written to for one
+    interval.
+    """
+    def __init__(self, engine, interval=10):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.pending = None  # changed version waiting to settle
+
+    def run(self):
+        seen = None
+        while True:
+            time.sleep(self.interval)
+            if self.engine.loaded is None:  # nothing to reload before first query
+                continue
+            seen = seen or self.engine.loaded.version
+            try:
+                version = file_version(data_files(self.engine.path))
+            except OSError:  # a file is being replaced
+                continue
+            if version != seen and version != self.engine.loaded.version:
+                if version == self.pending:  # settled
+                    self.engine.reload()
+                    seen = version
+                self.pending = version
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# optional SQLite storage and query backend for Aptbot
+#
+# build the database from the output of parser.parse_apt with:
+#   python store.py ../data/groups.pkl ../data/aptbot.db
+# and point the bot at it with: export APTBOT_DB=../data/aptbot.db
+
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+from array import array
+from fuzzy import Suggesters
+from index import FIELDS
+from rank import score_keys
+
+SCHEMA_VERSION = 1  # bump whenever the database layout changes
+# command -> (table, group attr) of the normalized key tables
+TABLES = {'group': ('names', 'names'), 'tool': ('tools', 'tools'),
+          'target': ('targets', 'targets'), 'ops': ('operations', 'operations')}
+
+
+def has_trigram():
+    """ returns whether the linked SQLite has the FTS5 trigram tokenizer """
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(value, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def build_database(groups, path):
+    """
+    writes groups to a new SQLite database at path, built aside and
+    renamed into place so a running bot never opens a partial database
+    """
+    if not has_trigram():
+        raise RuntimeError('SQLite {} has no FTS5 trigram tokenizer, the database '
+                           'needs SQLite 3.34 or later'.format(sqlite3.sqlite_version))
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        write_database(groups, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_database(groups, path):
+    """ writes groups to a new SQLite database file at path """
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('CREATE TABLE groups (id INTEGER PRIMARY KEY, gid TEXT UNIQUE, '
+                     'country TEXT, body TEXT)')
+        for table, _ in TABLES.values():
+            conn.execute('CREATE TABLE {0} (id INTEGER PRIMARY KEY, '
+                         'group_id INTEGER REFERENCES groups(id), value TEXT)'.format(table))
+            conn.execute('CREATE INDEX {0}_group ON {0}(group_id)'.format(table))
+            # trigram tokens answer substring queries from the index
+            conn.execute("CREATE VIRTUAL TABLE {0}_fts USING fts5(value, content='{0}', "
+                         "content_rowid='id', tokenize='trigram')".format(table))
+        # distinct keys of every field in casefolded order, for completions
+        conn.execute('CREATE TABLE keys (field TEXT, folded TEXT, value TEXT, '
+                     'PRIMARY KEY (field, folded, value)) WITHOUT ROWID')
+
+        for group_id, (gid, group) in enumerate(groups.items()):
+            conn.execute('INSERT INTO groups VALUES (?, ?, ?, ?)',
+                         (group_id, gid, group.get('country'), json.dumps(group)))
+            for table, attr in TABLES.values():
+                conn.executemany('INSERT INTO {} (group_id, value) VALUES (?, ?)'.format(table),
+                                 [(group_id, value) for value in group.get(attr, [])])
+
+        for table, _ in TABLES.values():
+            conn.execute("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table))
+        attrs = dict(((cmmd, attr) for cmmd, (_, attr) in TABLES.items()), country='country')
+        keys = {(cmmd, key.strip().casefold(), key.strip())
+                for cmmd, attr in attrs.items()
+                for group in groups.values()
+                for key in listed(group.get(attr)) if key.strip()}
+        conn.executemany('INSERT INTO keys VALUES (?, ?, ?)', sorted(keys))
+        conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def listed(value):
+    """ returns a list value as is, and a single value as a list """
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class SqliteIndex:
+    """
+    Instantiates a lookup index answering from a read-only SQLite database
+    built by build_database, so groups are only loaded when they match.
+    Several bot processes can share one database file. Completions are
+    answered from the database too, only the suggestion indexes of
+    fuzzy.Suggesters hold the distinct keys in memory.
+    """
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError('no database at {}, run store.py to build it'.format(path))
+        self.path = path
+        self.local = threading.local()  # one connection per thread
+        self.suggesters = Suggesters(self.keys, FIELDS)
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True)
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                conn.close()
+                raise ValueError('database at {} has an older layout, '
+                                 'rerun store.py to rebuild it'.format(self.path))
+            self.local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self.conn.execute('SELECT count(*) FROM groups').fetchone()[0]
+
+    def ids(self):
+        """ returns the ids of every group """
+        return array('I', range(len(self)))
+
+    def resolve(self, ids):
+        """ returns the gid -> group map of ids """
+        rows = self.conn.execute(
+            'SELECT gid, body FROM groups WHERE id IN (SELECT value FROM json_each(?)) '
+            'ORDER BY id', (json.dumps(list(ids)),))
+        return {gid: json.loads(body) for gid, body in rows}
+
+    def lookup(self, cmmd, arg):
+        """ returns the sorted ids of groups with a key containing arg """
+        if cmmd == 'country':
+            rows = self.conn.execute('SELECT id FROM groups WHERE '
+                                     'instr(lower(country), lower(?)) ORDER BY id', (arg,))
+            return array('I', (row[0] for row in rows))
+        rows = self.conn.execute('SELECT DISTINCT group_id FROM {} WHERE id IN ({}) '
+                                 'ORDER BY group_id'.format(TABLES[cmmd][0], self.match(cmmd, arg)),
+                                 (self.param(arg),))
+        return array('I', (row[0] for row in rows))
+
+    def scores(self, cmmd, arg):
+        """ returns the relevance score of each group id matching arg """
+        if cmmd == 'country':
+            rows = self.conn.execute('SELECT country, id FROM groups WHERE '
+                                     'instr(lower(country), lower(?))', (arg,))
+        else:
+            rows = self.conn.execute('SELECT value, group_id FROM {} WHERE id IN ({})'.format(
+                TABLES[cmmd][0], self.match(cmmd, arg)), (self.param(arg),))
+        return score_keys(cmmd, arg, ((value, (idx,)) for value, idx in rows))
+
+    def suggest(self, cmmd, arg, limit=5):
+        """ returns up to limit keys of cmmd closest to arg by edit distance """
+        return self.suggesters.suggest(cmmd, arg, limit)
+
+    def complete(self, cmmd, prefix, limit=10):
+        """ returns up to limit keys of cmmd starting with prefix, like PrefixIndex """
+        prefix = prefix.strip().casefold()
+        rows = self.conn.execute('SELECT value FROM keys WHERE field = ? AND folded >= ? '
+                                 'AND folded < ? ORDER BY folded, value LIMIT ?',
+                                 (cmmd, prefix, prefix + '\U0010ffff', limit))
+        return [row[0] for row in rows]
+
+    def keys(self, cmmd):
+        """ returns the distinct keys of cmmd """
+        rows = self.conn.execute('SELECT value FROM keys WHERE field = ?', (cmmd,))
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def match(cmmd, arg):
+        """ returns the query selecting ids of key rows containing arg """
+        table = TABLES[cmmd][0]
+        if len(arg) >= 3:  # every trigram of arg must be in the key
+            return 'SELECT rowid FROM {0}_fts WHERE {0}_fts MATCH ?'.format(table)
+        # too short for trigrams, scan the key table
+        return 'SELECT id FROM {} WHERE instr(lower(value), lower(?))'.format(table)
+
+    @staticmethod
+    def param(arg):
+        return '"{}"'.format(arg.replace('"', '""')) if len(arg) >= 3 else arg
+
+    def find(self, cmmd, arg):
+        """ returns the gid -> group map of groups with a key containing arg """
+        if cmmd == 'country':
+            return self.resolve(self.lookup(cmmd, arg))
+        rows = self.conn.execute(
+            'SELECT gid, body FROM groups WHERE id IN (SELECT group_id FROM {} '
+            'WHERE id IN ({})) ORDER BY id'.format(TABLES[cmmd][0], self.match(cmmd, arg)),
+            (self.param(arg),))
+        return {gid: json.loads(body) for gid, body in rows}
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as f:
+        build_database(pickle.load(f), sys.argv[2])
@@ -1,5 +1,54 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+import openpyxl
 from bot import Bot
+from array import array
+from runner import AsyncRunner
+from outbox import Outbox
+from cache import ResponseCache, SingleFlight
+from Serializer import Serializer
+from store import build_database, has_trigram, SqliteIndex
+from records import GroupRecord
+from events import create_app
+from workspaces import Hub
+from engine import Engine
+from identity import IdentityCache
+from snapshot import Snapshot
+from metrics import METRICS, Registry
+from benchmarks.fakeslack import FakeSlackClient, FakeSession, FakeResponse
+from benchmarks.localslack import LocalSlack, LocalSlackClient
+from index import TrigramIndex, CommandIndex, PrefixIndex, SNAPSHOT_VERSION, intersect, \
+    build_snapshot
+from query import parse, evaluate
+from ingest import read, merge, iter_array, load, save
+from parser import iter_apt
+from fuzzy import BKTree, Suggester, Suggesters, levenshtein
+from rank import Ranking, match_score, EXACT, PREFIX, TOKEN, SUBSTRING
+
+
+def setUpModule():
+    # bots cache their ids by token, keep them out of the home directory
+    global cache_dir, environ
+    cache_dir = tempfile.TemporaryDirectory()
+    environ = os.environ.get('APTBOT_CACHE_DIR')
+    os.environ['APTBOT_CACHE_DIR'] = cache_dir.name
+
+
+def tearDownModule():
+    if environ is None:
+        os.environ.pop('APTBOT_CACHE_DIR', None)
+    else:
+        os.environ['APTBOT_CACHE_DIR'] = environ
+    cache_dir.cleanup()
+
 
 class TestAptBot(unittest.TestCase):
     def test_help(self):
@@ -32,5 +81,740 @@ class TestAptBot(unittest.TestCase):
         length = bot.handle_command('ops desert')
         self.assertEqual(length, 1)
 
+
+class TestTrigramIndex(unittest.TestCase):
+    keys = ['PlugX/Sogu', ' Pirpi', 'Backdoor.APT.Fexel', 'x', '']
+
+    def test_matches_scan(self):
+        index = TrigramIndex(self.keys)
+        for query in ['plugx', 'PIRPI', 'door', 'pt.f', 'x', 'zzz']:
+            expected = [k for k in self.keys if query.casefold() in k.casefold()]
+            self.assertEqual(index.search(query), expected)
+
+    def test_short_query(self):
+        index = TrigramIndex(self.keys)
+        self.assertEqual(index.search(''), self.keys)
+
+    def test_prefix(self):
+        keys = [key.strip() for key in self.keys + [' plugx'] if key.strip()]
+        index = PrefixIndex(keys)
+        for prefix in ['plug', 'P', 'pirpi', 'zzz', '']:
+            expected = sorted({k for k in keys if k.casefold().startswith(prefix.casefold())},
+                              key=lambda k: (k.casefold(), k))
+            self.assertEqual(index.complete(prefix, limit=100), expected)
+        self.assertEqual(len(index.complete('', limit=2)), 2)
+
+
+class TestCommandIndex(unittest.TestCase):
+    snapshot = {'version': SNAPSHOT_VERSION, 'gids': ['1_2', '1_3', '2_2'],
+                'group': {'APT 2': array('I', [0]), 'APT 3': array('I', [1])},
+                'tool': {'PlugX': array('I', [1, 2])},
+                'target': {}, 'ops': {}}
+
+    def test_shared_key(self):
+        index = CommandIndex(self.snapshot, {'1_2': {}, '1_3': {}, '2_2': {}})
+        self.assertEqual(list(index.lookup('tool', 'plugx')), [1, 2])
+        self.assertEqual(list(index.lookup('group', 'apt')), [0, 1])
+        self.assertEqual(list(index.find('tool', 'plugx')), ['1_3', '2_2'])
+
+    def test_intersect(self):
+        self.assertEqual(list(intersect(array('I', [0, 2, 5]),
+                                        array('I', [1, 2, 5, 7]))), [2, 5])
+
+    def test_skewed_intersect(self):
+        self.assertEqual(list(intersect(array('I', [3, 40, 99]),
+                                        array('I', range(0, 100, 2)))), [40])
+
+    def test_stale_snapshot(self):
+        with self.assertRaises(ValueError):
+            CommandIndex({'group': {'APT 2': '1_2'}}, {})
+
+
+class TestAsyncRunner(unittest.TestCase):
+    def test_answers_without_polling_delay(self):
+        client = FakeSlackClient(post_delay=0.2)
+        bot = Bot(client=client, outbox=Outbox('xoxb-test', session=client.session))
+        runner = AsyncRunner(bot, concurrency=4)
+        for i, query in enumerate(['group APT 2', 'tool backdoor',
+                                   'target japan', 'ops desert']):
+            client.inject(query, 'C{}'.format(i))
+
+        async def serve():
+            task = asyncio.ensure_future(runner.serve())
+            while len(client.posts) < 4:
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        # four slow posts run concurrently instead of one per second
+        asyncio.run(asyncio.wait_for(serve(), timeout=0.6))
+        self.assertEqual(len(client.posts), 4)
+
+
+class TestIdentity(unittest.TestCase):
+    def test_connection_corrects_cached_id(self):
+        IdentityCache().put('xoxb-stale', 'UWRONG')
+        client = FakeSlackClient(bot_id='UREAL')
+        bot = Bot(client=client, token='xoxb-stale',
+                  outbox=Outbox('xoxb-stale', session=client.session))
+        self.assertEqual(bot.bot_id, 'UWRONG')
+        self.assertTrue(bot.connect())
+        self.assertEqual(bot.at_bot, '<@UREAL>')
+        self.assertEqual(IdentityCache().get('xoxb-stale'), 'UREAL')
+
+
+class TestSlackBatch(unittest.TestCase):
+    def test_batch(self):
+        client = FakeSlackClient()
+        outbox = Outbox('xoxb-test', session=client.session)
+        bot = Bot(client=client, outbox=outbox)
+        mention = '<@{}> '.format(client.bot_id)
+        batch = bot.parse_slack_batch([
+            {'type': 'message', 'channel': 'C1', 'text': mention + 'tool backdoor'},
+            {'type': 'message', 'channel': 'C2', 'text': 'not for the bot'},
+            {'type': 'message', 'channel': 'C2', 'text': mention + 'tool backdoor'},
+            {'type': 'message', 'channel': 'C1', 'text': mention + 'tool backdoor'},
+            {'type': 'message', 'channel': 'C1', 'text': mention + 'help'}])
+        self.assertEqual(dict(batch), {'tool backdoor': ['C1', 'C2'],
+                                       'help': ['C1']})
+        bot.handle_batch(batch)
+        outbox.flush(timeout=5)
+        self.assertEqual(len(client.posts), 3)
+
+
+class TestReload(unittest.TestCase):
+    def test_swap_and_failed_reload(self):
+        client = FakeSlackClient()
+        outbox = Outbox('xoxb-test', session=client.session)
+        bot = Bot(client=client, outbox=outbox)
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ['groups.pkl', 'command_to_gid.pkl']:
+                shutil.copy('../data/' + name, tmp)
+            bot.engine.path = tmp + '/'
+            old = bot.snapshot
+            bot.reload('C1')
+            self.assertIsNot(bot.snapshot, old)
+            self.assertEqual(bot.handle_command('tool backdoor'), 8)
+
+            with open(tmp + '/command_to_gid.pkl', 'wb') as f:
+                f.write(b'truncated')
+            current = bot.snapshot
+            bot.reload('C1')
+            self.assertIs(bot.snapshot, current)
+        outbox.flush(timeout=5)
+        reports = [kwargs['text'] for _, kwargs in client.posts]
+        self.assertTrue(reports[0].startswith('loaded data'))
+        self.assertTrue(reports[1].startswith('reload failed'))
+
+    @unittest.skipUnless(has_trigram(), 'SQLite has no FTS5 trigram tokenizer')
+    def test_corrupt_database(self):
+        engine = Engine()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aptbot.db')
+            build_database({'1_2': {'country': 'China', 'names': ['APT 2']}}, path)
+            os.environ['APTBOT_DB'] = path
+            try:
+                current = engine.snapshot
+                self.assertEqual(len(current.index), 1)
+                with open(path + '.new', 'wb') as f:
+                    f.write(b'half a database')
+                os.replace(path + '.new', path)
+                self.assertTrue(engine.reload().startswith('reload failed'))
+                self.assertIs(engine.snapshot, current)
+                current.index.conn.close()
+            finally:
+                del os.environ['APTBOT_DB']
+
+
+class TestEvents(unittest.TestCase):
+    def test_ack_and_dedupe(self):
+        client = FakeSlackClient()
+        outbox = Outbox('xoxb-test', session=client.session)
+        app = create_app(Bot(client=client, outbox=outbox), workers=2)
+        http = app.test_client()
+        reply = http.post('/listening', data='{"challenge": "abc"}')
+        self.assertEqual(reply.get_data(as_text=True), 'abc')
+
+        event = {'event_id': 'Ev1', 'event': {
+            'type': 'app_mention', 'channel': 'C1',
+            'text': '<@{}> tool backdoor'.format(client.bot_id)}}
+        for _ in range(2):  # the second is a Slack retry
+            reply = http.post('/listening', data=json.dumps(event))
+            self.assertEqual(reply.status_code, 200)
+        self.assertEqual(app.events.stats['duplicates'], 1)
+        app.events.events.join()
+        outbox.flush(timeout=5)
+        self.assertEqual(len(client.posts), 1)
+
+    def test_options(self):
+        bot = Bot(client=FakeSlackClient())
+        bot.snapshot.index.suggesters.wait()  # keys complete once their indexes are built
+        app = create_app(bot, workers=1)
+        reply = app.test_client().post('/options', data={
+            'payload': json.dumps({'type': 'block_suggestion', 'value': 'tool plug'})})
+        values = [option['value'] for option in reply.get_json()['options']]
+        self.assertEqual(values, ['tool PlugX', 'tool PlugX/Sogu'])
+
+
+class TestHub(unittest.TestCase):
+    def test_workspaces_share_engine(self):
+        sink = FakeSlackClient()
+        hub = Hub(outbox=Outbox(None, session=sink.session))
+        clients = [FakeSlackClient(bot_id='UBOT{}'.format(i)) for i in range(3)]
+        bots = [hub.add('xoxb-{}'.format(i), client)
+                for i, client in enumerate(clients)]
+        self.assertTrue(all(bot.snapshot is bots[0].snapshot for bot in bots))
+        for client in clients:
+            client.inject('tool backdoor', 'C1')  # same channel id, other teams
+
+        async def serve():
+            task = asyncio.ensure_future(hub.serve())
+            while len(sink.posts) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        asyncio.run(asyncio.wait_for(serve(), timeout=5))
+        tokens = sorted(kwargs['token'] for _, kwargs in sink.posts)
+        self.assertEqual(tokens, ['xoxb-0', 'xoxb-1', 'xoxb-2'])
+        self.assertEqual(len(hub.engine.cache.entries), 1)
+        self.assertTrue(os.path.exists(os.path.join(cache_dir.name, 'identity.json')))
+
+
+class TestLocalSlack(unittest.TestCase):
+    def test_end_to_end(self):
+        slack = LocalSlack()
+        client = LocalSlackClient(slack)
+        bot = Bot(client=client, outbox=Outbox(client.token, url=slack.url))
+        threading.Thread(target=bot.run, daemon=True).start()
+        self.assertTrue(slack.connected.wait(5))
+        slack.inject('tool backdoor', 'C1')
+        deadline = time.monotonic() + 5
+        while not slack.posts and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(slack.posts[0][1]['channel'], 'C1')
+        form = slack.posts[0][1]
+        self.assertTrue(form['text'].startswith('8 groups match'))
+        self.assertIn('backdoor', form.get('blocks', form['text']).lower())
+
+
+class TestOutbox(unittest.TestCase):
+    def test_rate_limited_channel(self):
+        client = FakeSlackClient()
+        client.session = FakeSession(client, rate_limit=20)
+        outbox = Outbox('xoxb-test', rate=100, burst=5, backoff=0.01,
+                        session=client.session)
+        for i in range(3):
+            outbox.send('C1', text=str(i))
+        outbox.send('C2', text='other')
+        self.assertTrue(outbox.flush(timeout=5))
+        self.assertEqual(outbox.stats['sent'], 4)
+        self.assertGreater(outbox.stats['rate_limited'], 0)
+        # 429s are waited out instead of dropped, and channel order holds
+        texts = [kwargs['text'] for _, kwargs in client.posts
+                 if kwargs['channel'] == 'C1']
+        self.assertEqual(texts, ['0', '1', '2'])
+
+    def test_undecodable_reply(self):
+        client = FakeSlackClient()
+
+        class HtmlResponse(FakeResponse):
+            def json(self):
+                raise ValueError('not JSON')
+
+        class BrokenSession(FakeSession):
+            def post(self, url, data=None, timeout=None):
+                if data['text'] == 'lost':
+                    return HtmlResponse(404, '<html>Not Found</html>')
+                return FakeSession.post(self, url, data, timeout)
+
+        def fail():
+            raise RuntimeError('callback failed')
+
+        outbox = Outbox('xoxb-test', workers=1, rate=100, burst=5, retries=1,
+                        backoff=0.01, session=BrokenSession(client))
+        outbox.send('C1', text='lost', done=fail)
+        outbox.send('C1', text='next')
+        # the bad reply is retried then dropped, and the worker carries on
+        self.assertTrue(outbox.flush(timeout=2))
+        self.assertEqual(outbox.stats['failed'], 1)
+        self.assertEqual([kwargs['text'] for _, kwargs in client.posts], ['next'])
+
+
+class TestBackpressure(unittest.TestCase):
+    def test_single_flight(self):
+        flights, started, release = SingleFlight(), threading.Event(), threading.Event()
+        results = []
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do('k', slow)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while flights.stats['coalesced'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(results), [('answer', False)] + [('answer', True)] * 3)
+        self.assertEqual(flights.stats, {'executed': 1, 'coalesced': 3})
+        self.assertEqual(flights.do('k', lambda: 'again'), ('again', False))
+
+    def test_shed_and_release(self):
+        client = FakeSlackClient()
+        outbox = Outbox('xoxb-test', session=client.session, rate=100, burst=10)
+        bot = Bot(client=client, outbox=outbox)
+        mention = '<@{}> '.format(client.bot_id)
+        events = [{'channel': 'C1', 'user': 'U1', 'text': mention + 'tool x{}'.format(i)}
+                  for i in range(6)]  # U1 may only have 3 unanswered
+        events += [{'channel': 'C1', 'user': 'U{}'.format(i), 'text': mention + 'ops {}'.format(i)}
+                   for i in range(2, 6)]  # C1 may only have 5
+        batch = bot.parse_slack_batch(events)
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(bot.stats, {'shed_channel': 2, 'shed_user': 3})
+        bot.handle_batch(batch)
+        self.assertTrue(outbox.flush(timeout=5))
+        deadline = time.monotonic() + 5
+        while bot.channel_admission.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(bot.channel_admission.pending, {})  # freed once delivered
+        self.assertEqual(bot.user_admission.pending, {})
+        self.assertEqual(len(bot.parse_slack_batch(events[:1])), 1)
+
+    def test_release_on_error(self):
+        client = FakeSlackClient()
+        bot = Bot(client=client, outbox=Outbox('xoxb-test', session=client.session))
+        mention = '<@{}> '.format(client.bot_id)
+        batch = bot.parse_slack_batch([{'channel': 'C1', 'user': 'U1',
+                                        'text': mention + 'tool backdoor'}])
+
+        def fail(text):
+            raise RuntimeError('lookup failed')
+
+        bot.respond = fail
+        with self.assertRaises(RuntimeError):
+            bot.handle_batch(batch)
+        self.assertEqual(bot.channel_admission.pending, {})
+        self.assertEqual(bot.user_admission.pending, {})
+
+    def test_release_one_request(self):
+        bot = Bot(client=FakeSlackClient())
+        self.assertTrue(bot.admit('tool backdoor', 'C1', 'U1'))
+        self.assertTrue(bot.admit('tool backdoor', 'C1', 'U2'))  # same text, still in flight
+        bot.release('tool backdoor', 'C1')  # the first reply is delivered
+        self.assertEqual(bot.channel_admission.pending, {'C1': 1})
+        self.assertEqual(bot.user_admission.pending, {'U2': 1})
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        with registry.span('lookup'):
+            pass
+        registry.observe('aptbot_stage_seconds', 3, stage='post')
+        registry.inc('aptbot_api_errors_total', kind='429')
+        registry.inc('aptbot_api_errors_total', kind=None)  # an error without a name
+        text = registry.render()
+        self.assertIn('aptbot_api_errors_total{kind="None"} 1', text)
+        self.assertIn('aptbot_api_errors_total{kind="429"} 1', text)
+        self.assertIn('aptbot_stage_seconds_bucket{stage="lookup",le="+Inf"} 1', text)
+        self.assertIn('aptbot_stage_seconds_bucket{stage="post",le="2.5"} 0', text)
+        self.assertIn('aptbot_stage_seconds_sum{stage="post"} 3', text)
+
+    def test_engine_stages(self):
+        bot = Bot(client=FakeSlackClient())
+        bot.snapshot.index.suggesters.wait()  # misses are cached once suggestions are
+        queries = METRICS.value('aptbot_queries_total', command='tool')
+        lookups = METRICS.histogram('aptbot_stage_seconds', stage='lookup').samples()[2]
+        bot.handle_command('tool metrics-probe')
+        bot.handle_command('tool metrics-probe')
+        self.assertEqual(METRICS.value('aptbot_queries_total', command='tool'), queries + 2)
+        self.assertEqual(METRICS.histogram('aptbot_stage_seconds', stage='lookup')
+                         .samples()[2], lookups + 1)  # second one is cached
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ResponseCache(maxsize=2)
+        cache.put(cache.key('tool', ' Mimikatz'), 1, 'a')
+        cache.put(cache.key('tool', 'plugx'), 1, 'b')
+        self.assertEqual(cache.get(('tool', 'mimikatz'), 1), 'a')
+        cache.put(cache.key('group', 'apt 28'), 1, 'c')  # evicts plugx
+        self.assertIsNone(cache.get(('tool', 'plugx'), 1))
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_new_snapshot_invalidates(self):
+        cache = ResponseCache()
+        cache.put(('tool', 'plugx'), 1, 'a')
+        self.assertIsNone(cache.get(('tool', 'plugx'), 2))
+
+
+class TestSerializer(unittest.TestCase):
+    def test_fragments_match_rendering(self):
+        groups = {'1_2': {'country': 'China', 'names': ['APT 2', 'SearchFire']},
+                  '1_3': {'country': 'China', 'tools': ['PlugX', ' Kaba']}}
+        serializer = Serializer()
+        expected = '\n'.join([
+            '2 groups match your search\n',
+            '\n'.join(['{0}\nGroup {1}\n{0}\n\n'.format('-' * 80, idx)
+                       + serializer.each_group(group)
+                       for idx, group in enumerate(groups.values(), 1)])])
+        self.assertEqual(serializer.groups_response(groups), expected)
+        self.assertEqual(serializer.groups_response(groups), expected)
+        self.assertEqual(len(serializer.fragments), 2)
+
+
+class TestPagination(unittest.TestCase):
+    def test_page(self):
+        groups = {str(i): {'names': ['APT {}'.format(i)]} for i in range(5)}
+        serializer = Serializer()
+        response = serializer.groups_response(groups, 2, 2)
+        self.assertTrue(response.startswith('5 groups match your search, showing 3-4'))
+        self.assertIn('Group 3\n', response)
+        self.assertNotIn('APT 1', response)
+        self.assertEqual(set(serializer.fragments), {'2', '3'})  # only the page is rendered
+
+    def test_chunks(self):
+        serializer = Serializer()
+        self.assertEqual(serializer.chunks('short'), [('short', None)])
+        text = '\n'.join(['header'] + ['x' * 1000] * 200 + ['y' * 7000])
+        messages = serializer.chunks(text)
+        sections = [block['text']['text'] for _, blocks in messages
+                    for block in json.loads(blocks)]
+        self.assertTrue(all(len(json.loads(blocks)) <= 50 for _, blocks in messages))
+        self.assertTrue(all(0 < len(section) <= 3000 for section in sections))
+        self.assertEqual(''.join(sections).replace('\n', ''), text.replace('\n', ''))
+        self.assertEqual(messages[0][0], 'header')
+
+    def test_more(self):
+        client = FakeSlackClient()
+        outbox = Outbox('xoxb-test', session=client.session, rate=100, burst=10)
+        bot = Bot(client=client, outbox=outbox, engine=Engine(page_size=3))
+        for text in ['tool backdoor', 'more', 'more', 'more']:
+            bot.handle_command(text, 'C1')
+        self.assertTrue(outbox.flush(timeout=5))
+        texts = [kwargs['text'].split('\n', 1)[0] for _, kwargs in client.posts]
+        self.assertEqual(texts, ['8 groups match your search, showing 1-3',
+                                 '8 groups match your search, showing 4-6',
+                                 '8 groups match your search, showing 7-8',
+                                 'Nothing more to show, please search again'])
+
+
+class TestSqliteIndex(unittest.TestCase):
+    @unittest.skipUnless(has_trigram(), 'SQLite has no FTS5 trigram tokenizer')
+    def test_matches_command_index(self):
+        groups = {'1_2': {'country': 'China', 'names': ['APT 2'], 'tools': ['PlugX']},
+                  '1_3': {'country': 'China', 'names': ['APT 3'],
+                          'tools': ['Shotput', ' PlugX/Sogu']}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aptbot.db')
+            build_database(groups, path)
+            index = SqliteIndex(path)
+            self.assertEqual(list(index.find('tool', 'plugx')), ['1_2', '1_3'])
+            self.assertEqual(index.find('group', 'T 3'), {'1_3': groups['1_3']})
+            self.assertEqual(len(index.find('group', 'a')), 2)  # short query
+            self.assertEqual(index.scores('tool', 'plugx'), {0: EXACT * 2, 1: PREFIX * 2})
+            # completions come from the database, in the order of PrefixIndex
+            for cmmd, attr in [('tool', 'tools'), ('country', 'country')]:
+                keys = [key for group in groups.values() for key in
+                        (group[attr] if attr != 'country' else [group[attr]])]
+                for prefix in ['p', 'PLUGX', 'ch', '', 'zzz']:
+                    self.assertEqual(index.complete(cmmd, prefix, 10),
+                                     PrefixIndex(keys).complete(prefix, 10))
+            self.assertEqual(sorted(index.keys('tool')), ['PlugX', 'PlugX/Sogu', 'Shotput'])
+            index.conn.close()
+
+    @unittest.skipUnless(has_trigram(), 'SQLite has no FTS5 trigram tokenizer')
+    def test_older_layout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aptbot.db')
+            build_database({'1_2': {'country': 'China', 'names': ['APT 2']}}, path)
+            conn = sqlite3.connect(path)
+            conn.execute('PRAGMA user_version = 0')
+            conn.close()
+            with self.assertRaises(ValueError):
+                len(SqliteIndex(path))
+
+
+class TestQuery(unittest.TestCase):
+    groups = {'1_2': {'country': 'China', 'names': ['APT 2'], 'tools': ['PlugX'],
+                      'targets': ['Japan']},
+              '1_3': {'country': 'China', 'names': ['APT 3'], 'tools': ['Shotput']},
+              '2_2': {'country': 'Russia', 'names': ['APT 28'],
+                      'tools': ['PlugX', 'X-Agent'], 'targets': ['NATO']}}
+    queries = {'country China AND tool PlugX AND target Japan': ['1_2'],
+               'tool plugx AND NOT country china': ['2_2'],
+               'tool PlugX OR tool Shotput': ['1_2', '1_3', '2_2'],
+               'NOT (target japan OR target nato)': ['1_3'],
+               'group apt AND NOT country china AND NOT tool x-agent': [],
+               'tool "plugx" AND group APT 28': ['2_2']}
+
+    def test_parse(self):
+        self.assertEqual(parse('tool PlugX AND NOT (target Japan OR country China)'),
+                         ('and', (('term', 'tool', 'plugx'),
+                                  ('not', ('or', (('term', 'target', 'japan'),
+                                                  ('term', 'country', 'china')))))))
+        self.assertEqual(parse('target Oil and Gas'), ('term', 'target', 'oil and gas'))
+        for text in ['tool', 'tool x AND', '(tool x', 'color red', 'tool "x']:
+            with self.assertRaises(ValueError):
+                parse(text)
+
+    @unittest.skipUnless(has_trigram(), 'SQLite has no FTS5 trigram tokenizer')
+    def test_evaluate(self):
+        index = CommandIndex(build_snapshot(self.groups), self.groups)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aptbot.db')
+            build_database(self.groups, path)
+            sqlite = SqliteIndex(path)
+            for text, expected in self.queries.items():
+                self.assertEqual(list(index.resolve(evaluate(parse(text), index))), expected)
+                self.assertEqual(list(sqlite.resolve(evaluate(parse(text), sqlite))), expected)
+            sqlite.conn.close()
+
+    def test_engine(self):
+        bot = Bot(client=FakeSlackClient())
+        self.assertEqual(bot.handle_command('query country China AND tool PlugX'),
+                         bot.handle_command('query tool plugx AND country china'))
+        groups, response = bot.respond('query tool PlugX AND')
+        self.assertTrue(response.startswith('invalid query'))
+
+
+class TestRanking(unittest.TestCase):
+    groups = {'2_2': {'names': ['APT 29', 'Cozy Bear']},
+              '1_5': {'names': ['Group APT 2 affiliate']},
+              '1_2': {'names': ['APT 2', 'SearchFire']},
+              '1_7': {'names': ['APT 22']},
+              '1_9': {'names': ['Zapt 2']}}
+
+    def test_match_score(self):
+        self.assertEqual(match_score(' APT 2', 'apt 2'), EXACT)
+        self.assertEqual(match_score('APT 22', 'apt 2'), PREFIX)
+        self.assertEqual(match_score('Group APT 2 affiliate', 'apt 2'), TOKEN)
+        self.assertEqual(match_score('Zapt 22', 'apt 2'), SUBSTRING)
+
+    def test_best_first(self):
+        index = CommandIndex(build_snapshot(self.groups), self.groups)
+        ranking = Ranking(index.scores('group', 'APT 2'), index)
+        self.assertEqual(list(ranking), ['1_2', '2_2', '1_7', '1_5', '1_9'])
+        self.assertEqual(ranking['1_5'], self.groups['1_5'])
+
+    def test_selects_lazily(self):
+        groups = {str(i): {'tools': ['PlugX']} for i in range(100)}
+        index = CommandIndex(build_snapshot(groups), groups)
+        ranking = Ranking(index.scores('tool', 'plugx'), index)
+        response = Serializer().groups_response(ranking, 0, 10)
+        self.assertTrue(response.startswith('100 groups match your search, showing 1-10'))
+        self.assertEqual(len(ranking.ordered), 10)
+        self.assertEqual(list(ranking), [str(i) for i in range(100)])  # ties in index order
+
+
+class TestFuzzy(unittest.TestCase):
+    terms = ['mimikatz', 'mimikittenz', 'plugx', 'plugx/sogu', 'poison ivy',
+             'gh0st rat', 'x-agent', 'x-tunnel', 'sofacy', 'sednit']
+
+    def test_levenshtein(self):
+        self.assertEqual(levenshtein('mimikats', 'mimikatz'), 1)
+        self.assertEqual(levenshtein('', 'abc'), 3)
+        self.assertEqual(levenshtein('kitten', 'sitting'), 3)
+
+    def test_bktree_matches_scan(self):
+        tree = BKTree(self.terms)
+        for query in ['mimikats', 'plugz', 'x-agnt', 'sofa', 'zzz']:
+            for k in [1, 2, 3]:
+                expected = sorted((levenshtein(query, t), t) for t in self.terms
+                                  if levenshtein(query, t) <= k)
+                self.assertEqual(sorted(tree.search(query, k)), expected)
+
+    def test_suggest(self):
+        suggester = Suggester([' Mimikatz', 'PlugX', 'Aerospace and Defence; Energy'])
+        self.assertEqual(suggester.suggest('mimikats'), ['Mimikatz'])
+        self.assertEqual(suggester.suggest('defense'), ['Aerospace and Defence; Energy'])
+        self.assertEqual(suggester.suggest('px'), [])  # too short to guess
+
+    def test_background_build(self):
+        release = threading.Event()
+
+        def keys(cmmd):
+            release.wait()
+            return {'tool': ['Mimikatz'], 'group': ['APT 28']}[cmmd]
+
+        suggesters = Suggesters(keys, ('tool', 'group'), PrefixIndex)
+        self.assertEqual(suggesters.suggest('tool', 'mimikats'), [])  # still building
+        self.assertEqual(suggesters.complete('tool', 'mim'), [])
+        self.assertFalse(suggesters.ready)
+        release.set()
+        self.assertTrue(suggesters.wait(timeout=5))
+        self.assertEqual(suggesters.suggest('tool', 'mimikats'), ['Mimikatz'])
+        self.assertEqual(suggesters.complete('tool', 'mim'), ['Mimikatz'])
+
+        # unchanged keys keep the index built for the previous snapshot
+        reloaded = Suggesters(lambda cmmd: {'tool': ['Mimikatz'], 'group': ['APT 29']}[cmmd],
+                              ('tool', 'group'), PrefixIndex)
+        reloaded.start(suggesters)
+        reloaded.wait(timeout=5)
+        self.assertIs(reloaded.built['tool'], suggesters.built['tool'])
+        self.assertIsNot(reloaded.built['group'], suggesters.built['group'])
+        self.assertEqual(reloaded.complete('group', 'apt'), ['APT 29'])
+
+    def test_did_you_mean(self):
+        bot = Bot(client=FakeSlackClient())
+        bot.snapshot.index.suggesters.wait()
+        groups, response = bot.respond('tool mimikats')
+        self.assertEqual(groups, {})
+        self.assertIn('Did you mean: "tool Mimikatz"', response)
+
+
+class TestIngest(unittest.TestCase):
+    bundle = {'type': 'bundle', 'id': 'bundle--1', 'objects': [
+        {'type': 'relationship', 'id': 'relationship--1', 'relationship_type': 'uses',
+         'source_ref': 'intrusion-set--1', 'target_ref': 'malware--1'},
+        {'type': 'intrusion-set', 'id': 'intrusion-set--1', 'name': 'APT 28',
+         'aliases': ['APT 28', 'Fancy Bear'],
+         'external_references': [{'url': 'https://example.com/apt28'}]},
+        {'type': 'malware', 'id': 'malware--1', 'name': 'X-Agent'},
+        {'type': 'location', 'id': 'location--1', 'name': 'Russia', 'country': 'RU'},
+        {'type': 'identity', 'id': 'identity--1', 'name': 'Defense'},
+        {'type': 'campaign', 'id': 'campaign--1', 'name': 'Operation Pawn Storm'},
+        {'type': 'relationship', 'id': 'relationship--2', 'relationship_type': 'targets',
+         'source_ref': 'intrusion-set--1', 'target_ref': 'identity--1'},
+        {'type': 'relationship', 'id': 'relationship--3', 'relationship_type': 'attributed-to',
+         'source_ref': 'intrusion-set--1', 'target_ref': 'location--1'},
+        {'type': 'relationship', 'id': 'relationship--4', 'relationship_type': 'attributed-to',
+         'source_ref': 'campaign--1', 'target_ref': 'intrusion-set--1'}]}
+
+    def test_iter_array_chunks(self):
+        text = json.dumps(self.bundle, indent=1)
+        for size in [1, 7, 1 << 16]:
+            self.assertEqual(list(iter_array(io.StringIO(text), 'objects', size)),
+                             self.bundle['objects'])
+
+    def test_feeds(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'feed.csv'), 'w') as f:
+                f.write('id,Country,Aliases,Tools,Targets,Link 1\n'
+                        'a1,China,APT 2; Putter Panda,PlugX;MSUpdater,,http://x\n'
+                        'a2,Iran,Charming Kitten,,Government;Media,\n')
+            with open(os.path.join(tmp, 'dump.jsonl'), 'w') as f:
+                f.write(json.dumps({'names': ['Lazarus'], 'tools': ['Destover'],
+                                    'country': 'North Korea'}) + '\n')
+            with open(os.path.join(tmp, 'bundle.json'), 'w') as f:
+                json.dump(self.bundle, f)
+            records = [record for feed in ['feed.csv', 'dump.jsonl', 'bundle.json']
+                       for record in read(os.path.join(tmp, feed))]
+        groups = dict(records)
+        self.assertEqual(groups['feed:a1'], {
+            'country': 'China', 'names': ['APT 2', 'Putter Panda'],
+            'tools': ['PlugX', 'MSUpdater'], 'Link 1': 'http://x'})
+        self.assertEqual(groups['dump:1']['tools'], ['Destover'])
+        self.assertEqual(groups['stix:intrusion-set--1'], {
+            'names': ['APT 28', 'Fancy Bear'], 'Link 1': 'https://example.com/apt28',
+            'tools': ['X-Agent'], 'targets': ['Defense'], 'country': 'Russia',
+            'Country code': 'RU', 'operations': ['Operation Pawn Storm']})
+
+    def test_incremental_merge(self):
+        base = {'1_2': {'country': 'China', 'names': ['APT 2'], 'tools': ['PlugX']},
+                '1_3': {'country': 'China', 'names': ['APT 3'], 'tools': ['Shotput']}}
+        feed = [('feed:1', {'country': 'Russia', 'names': ['APT 28'], 'tools': ['PlugX']}),
+                ('1_3', {'country': 'China', 'names': ['APT 3'], 'tools': ['PlugX']})]
+        groups, dct = dict(base), build_snapshot(base)
+        self.assertEqual(merge(groups, dct, iter(feed)), (1, 1))
+        self.assertEqual(dct, build_snapshot(groups))  # same as a full rebuild
+        index = CommandIndex(dct, groups)
+        self.assertEqual(list(index.find('tool', 'plugx')), ['1_2', '1_3', 'feed:1'])
+        self.assertEqual(index.find('tool', 'shotput'), {})
+
+    def test_malformed_records(self):
+        bundle = {'type': 'bundle', 'objects': [
+            {'type': 'intrusion-set', 'id': 'intrusion-set--1', 'name': 'APT 28'},
+            {'type': 'relationship', 'relationship_type': 'attributed-to',
+             'source_ref': 'intrusion-set--1', 'target_ref': 'location--9'}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'feed.csv'), 'w') as f:
+                f.write('id,Aliases\n'
+                        'a1,APT 2,extra,cells\n')  # longer than the header
+            with open(os.path.join(tmp, 'dump.jsonl'), 'w') as f:
+                f.write(json.dumps({'names': ['Lazarus', 38, None, ' ']}) + '\n')
+            with open(os.path.join(tmp, 'bundle.json'), 'w') as f:
+                json.dump(bundle, f)
+            groups = dict(record for feed in ['feed.csv', 'dump.jsonl', 'bundle.json']
+                          for record in read(os.path.join(tmp, feed)))
+        self.assertEqual(groups['feed:a1'], {'names': ['APT 2']})
+        self.assertEqual(groups['dump:1'], {'names': ['Lazarus', '38']})
+        # a location missing from the bundle leaves the country unset
+        self.assertEqual(groups['stix:intrusion-set--1'], {'names': ['APT 28']})
+
+    def test_save_pair(self):
+        base = {'1_2': {'country': 'China', 'names': ['APT 2'], 'tools': ['PlugX']}}
+        with tempfile.TemporaryDirectory() as tmp:
+            data = tmp + '/'
+            save(data, base, build_snapshot(base))
+            groups, dct = load(data)
+            self.assertEqual(groups, base)
+            with open(data + 'command_to_gid.pkl', 'rb') as f:
+                old_index = f.read()
+            merge(groups, dct, iter([('feed:1', {'names': ['APT 28']})]))
+            save(data, groups, dct)
+            # new groups read with the index they replace are rejected
+            with open(data + 'command_to_gid.pkl', 'wb') as f:
+                f.write(old_index)
+            with self.assertRaises(ValueError):
+                load(data)
+            with self.assertRaises(ValueError):
+                Snapshot(data)
+
+    def test_second_workbook(self):
+        base = {'1_2': {'country': 'China', 'names': ['APT 2'], 'tools': ['PlugX']}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'vendor.xlsx')
+            book = openpyxl.Workbook()
+            book.active.title = 'Home'
+            sheet = book.create_sheet('Russia')
+            for row in [['title'], ['Common Name', 'Toolset / Malware'], [None, None],
+                        ['APT 28', 'X-Agent']]:
+                sheet.append(row)
+            book.save(path)
+            groups, dct = dict(base), build_snapshot(base)
+            # the workbook's gid 1_2 does not overwrite the base group 1_2
+            self.assertEqual(merge(groups, dct, read(path)), (1, 0))
+        self.assertEqual(groups['1_2'], base['1_2'])
+        self.assertEqual(groups['vendor:1_2'], {'country': 'Russia', 'names': ['APT 28'],
+                                                'tools': ['X-Agent']})
+
+
+class TestParser(unittest.TestCase):
+    def test_sheet_without_classified_columns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'APT.xlsx')
+            book = openpyxl.Workbook()
+            book.active.title = 'Home'
+            sheet = book.create_sheet('Russia')
+            for row in [['title'], [None, None], [None, None], ['x', 'y'], ['z', None]]:
+                sheet.append(row)
+            book.save(path)
+            # rows still become country-only groups
+            self.assertEqual(list(iter_apt(path)),
+                             [('1_2', {'country': 'Russia', 'names': []}),
+                              ('1_3', {'country': 'Russia', 'names': []})])
+
+
+class TestGroupRecord(unittest.TestCase):
+    def test_same_items_as_dict(self):
+        group = {'country': 'China', 'names': ['APT 2', 'SearchFire'],
+                 'CrowdStrike': 'Putter Panda', 'tools': ['MSUpdater'],
+                 'Link 1': 'http://example.com'}
+        record = GroupRecord(group)
+        self.assertEqual(list(record), list(group))
+        self.assertEqual(record['names'], ('APT 2', 'SearchFire'))
+        self.assertEqual(record['Link 1'], 'http://example.com')
+        self.assertNotIn('targets', record)
+        self.assertIsNone(record.get('operations'))
+        self.assertEqual(Serializer().each_group(record),
+                         Serializer().each_group(group))
+
+
 if __name__ == '__main__':
     unittest.main()
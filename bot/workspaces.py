@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# by Seungmin Lee
+# serving many Slack workspaces from one Aptbot process
+#
+# run using: python workspaces.py, with BOT_TOKENS set to a
+# comma-separated list of bot tokens
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from bot import Bot
+from engine import Engine
+from outbox import Outbox
+from runner import AsyncRunner
+from snapshot import SnapshotWatcher
+from metrics import serve_from_env
+
+
+class Hub:
+    """
+    Instantiates a set of workspace Bots sharing one Engine (data snapshot
+    and response cache), one Outbox (pooled session; rate limits are kept
+    per token and channel) and one pool of handler threads, so memory
+    stays flat as workspaces are added. Each Bot keeps its own token,
+    connection and identity.
+    """
+    def __init__(self, engine=None, outbox=None, concurrency=16):
+        self.engine = engine or Engine()
+        self.outbox = outbox or Outbox(None, workers=8)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.concurrency = concurrency
+        self.bots = []
+
+    def add(self, token, client=None):
+        """ adds a workspace served with token, returning its Bot """
+        bot = Bot(client=client, outbox=self.outbox, token=token, engine=self.engine)
+        self.bots.append(bot)
+        return bot
+
+    async def serve(self):
+        """ connects every workspace and serves them all on one event loop """
+        runners = []
+        for bot in self.bots:
+            if bot.connect():
+                print("APT bot connected to workspace as {}!".format(bot.at_bot))
+                runners.append(AsyncRunner(bot, self.concurrency, self.executor))
+            else:
+                print("Connection failed for a workspace. Invalid Slack token?")
+        # a workspace that disconnects does not stop the others
+        await asyncio.gather(*(runner.serve() for runner in runners),
+                             return_exceptions=True)
+
+    def run(self):
+        SnapshotWatcher(self.engine).start()
+        serve_from_env()
+        asyncio.run(self.serve())
+
+
+if __name__ == '__main__':
+    hub = Hub()
+    for token in filter(None, os.environ.get('BOT_TOKENS', '').split(',')):
+        hub.add(token)
+    hub.run()